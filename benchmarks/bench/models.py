@@ -0,0 +1,34 @@
+"""Synthetic models for the benchmarks, shaped by the DOCK_BENCH environment variable.
+
+Model0 is the hub that all other models relate to: each ModelN, for N > 0,
+has a foreign key and a many to many field to Model0, so every row of the
+dataset resolves related instances.
+
+"""
+import os
+import json
+from django.db import models
+
+
+CONFIG = json.loads(os.environ.get('DOCK_BENCH', '{}'))
+
+
+def _attrs(index):
+
+    attrs = {
+        '__module__': __name__,
+        'name': models.CharField(max_length=255, db_index=True),
+        'slug': models.CharField(max_length=255, db_index=True),
+        'value': models.IntegerField(null=True, blank=True),
+    }
+
+    if index:
+        attrs['parent'] = models.ForeignKey('Model0', null=True, blank=True, related_name='+')
+        attrs['tags'] = models.ManyToManyField('Model0', blank=True, related_name='+')
+
+    return attrs
+
+
+for index in range(CONFIG.get('models', 3)):
+    name = 'Model%s' % index
+    globals()[name] = type(name, (models.Model,), _attrs(index))
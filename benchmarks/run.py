@@ -0,0 +1,210 @@
+"""Benchmarks for the incoming pipeline, against a local SQLite database.
+
+Run `python -m benchmarks.run --help` from the repository root.
+
+"""
+from __future__ import print_function
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+
+MODES = ('store', 'bulk', 'stream', 'pipeline')
+
+PHASES = ('extract', 'clean', 'prepare', 'lookup', 'save')
+
+
+def generate(root, models=3, rows=1000, depth=1, branches=1, fan_out=10, m2m=1):
+    """Write a synthetic dataset tree at `root`, and return the number of rows in it.
+
+    The data sources of every model are in a `bench` directory, the app label of
+    the benchmark models, at `depth` directories below `root`. Models are spread
+    over `branches` top level directories, and Model0 always comes first.
+
+    """
+
+    def write_index(directory, ordering):
+        with open(os.path.join(directory, 'index.json'), 'w') as f:
+            json.dump({'ordering': ordering}, f)
+
+    leaves = {}
+    for index in range(models):
+        leaves.setdefault(index % branches, []).append(index)
+
+    write_index(root, ['branch%s' % branch for branch in sorted(leaves)])
+
+    for branch, indexes in sorted(leaves.items()):
+        directory = os.path.join(root, 'branch%s' % branch)
+        os.makedirs(directory)
+
+        for level in ['level%s' % level for level in range(depth - 1)] + ['bench']:
+            write_index(directory, [level])
+            directory = os.path.join(directory, level)
+            os.makedirs(directory)
+
+        write_index(directory, ['model%s' % index for index in indexes])
+
+        for index in indexes:
+            with open(os.path.join(directory, 'model%s.csv' % index), 'w') as f:
+                writer = csv.writer(f)
+
+                if not index:
+                    writer.writerow(['name', 'slug', 'value'])
+                    for row in range(rows):
+                        writer.writerow(['model0-%s' % row, 'model0-%s' % row, row])
+                    continue
+
+                writer.writerow(['name', 'slug', 'value', 'parent', 'tags'])
+                for row in range(rows):
+                    tags = ';'.join('model0-%s' % ((row + n) % fan_out) for n in range(m2m))
+                    writer.writerow(['model%s-%s' % (index, row), 'model%s-%s' % (index, row), row,
+                                     'model0-%s' % (row % fan_out), tags])
+
+    return models * rows
+
+
+def load(data_root, mode):
+    """Load the dataset at `data_root` into a fresh database, and return the LoadStats report."""
+
+    from django.core.management import call_command
+    from django.db import connections
+    from dock.core.incoming import Unload, Process, BulkStore, Store, LoadStats
+
+    for connection in connections.all():
+        connection.close()
+
+    database = os.environ['DOCK_BENCH_DB']
+    if os.path.exists(database):
+        os.remove(database)
+
+    call_command('migrate', verbosity=0, interactive=False)
+
+    stats = LoadStats(count_queries=True)
+    Process(Unload(data_root).map_inventory(),
+            storage_class=Store if mode == 'store' else BulkStore,
+            stream=mode in ('stream', 'pipeline'),
+            pipeline=mode == 'pipeline',
+            stats=stats)
+
+    return stats.report()
+
+
+def summary(report):
+    """Returns the seconds and rows per second of each phase, over all models."""
+
+    rows = report['rows']
+    phases = {}
+
+    for phase in PHASES:
+        seconds = sum(model['phases'].get(phase, 0) for model in report['models'].values())
+        phases[phase] = {'seconds': seconds, 'rows_per_second': rows / seconds if seconds else None}
+
+    return {
+        'rows': rows,
+        'seconds': report['seconds'],
+        'rows_per_second': rows / report['seconds'] if report['seconds'] else None,
+        'queries': sum(model['queries'] or 0 for model in report['models'].values()),
+        'phases': phases,
+    }
+
+
+def compare(before, after):
+
+    with open(before) as f:
+        before = json.load(f)
+    with open(after) as f:
+        after = json.load(f)
+
+    for mode, run in sorted(after['runs'].items()):
+        if mode not in before['runs']:
+            continue
+
+        old, new = before['runs'][mode]['summary'], run['summary']
+        print('%s: %.2fs -> %.2fs (%+.1f%%)' % (mode, old['seconds'], new['seconds'],
+                                               (new['seconds'] / old['seconds'] - 1) * 100))
+
+        for phase in PHASES:
+            old_seconds, new_seconds = old['phases'][phase]['seconds'], new['phases'][phase]['seconds']
+            if old_seconds:
+                print('  %-8s %.2fs -> %.2fs (%+.1f%%)' % (phase, old_seconds, new_seconds,
+                                                         (new_seconds / old_seconds - 1) * 100))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--models', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--branches', type=int, default=1)
+    parser.add_argument('--fan-out', type=int, default=10)
+    parser.add_argument('--m2m', type=int, default=1)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--keep', action='store_true', help="keep the generated dataset and database")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+
+    config = {
+        'models': args.models,
+        'rows': args.rows,
+        'depth': args.depth,
+        'branches': args.branches,
+        'fan_out': args.fan_out,
+        'm2m': args.m2m,
+    }
+
+    workspace = tempfile.mkdtemp(prefix='dock-bench-')
+    data_root = os.path.join(workspace, 'data')
+    os.makedirs(data_root)
+
+    # the benchmark models are shaped by this, so it has to be set before django is
+    os.environ['DOCK_BENCH'] = json.dumps(config)
+    os.environ['DOCK_BENCH_DB'] = os.path.join(workspace, 'bench.sqlite3')
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+    try:
+        start = time.time()
+        rows = generate(data_root, **config)
+        print('generated %s rows in %.2fs at %s' % (rows, time.time() - start, data_root))
+
+        runs = {}
+        for mode in args.modes:
+            report = load(data_root, mode)
+            runs[mode] = {'report': report, 'summary': summary(report)}
+            print('%s: %s rows in %.2fs, %.0f rows/s' % (mode, rows, report['seconds'],
+                                                         runs[mode]['summary']['rows_per_second'] or 0))
+
+        results = {
+            'config': config,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'runs': runs,
+        }
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+        print('results written to %s' % args.output)
+
+    finally:
+        if not args.keep:
+            shutil.rmtree(workspace)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
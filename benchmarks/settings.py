@@ -0,0 +1,15 @@
+import os
+
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DOCK_BENCH_DB', os.path.join(os.path.dirname(__file__), 'bench.sqlite3')),
+    }
+}
+
+INSTALLED_APPS = ['benchmarks.bench']
+
+SECRET_KEY = 'dock-benchmarks'
+
+DEBUG = False
@@ -0,0 +1,73 @@
+"""Load a dataset into the data store, and report how long it took to start up.
+
+Run `dock --help`, or `python -m dock.cli --help`.
+
+"""
+from __future__ import print_function
+import time
+
+# as early as we can, so the startup time covers the imports below too
+STARTED = time.time()
+
+import os
+import sys
+import json
+import argparse
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('data_root', help="the root directory of the dataset")
+    parser.add_argument('--settings', help="the Django settings module, instead of DJANGO_SETTINGS_MODULE")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only load what changed in the dataset repository since the last load")
+    parser.add_argument('--manifest', help="the manifest file, to skip the data sources that did not change")
+    parser.add_argument('--bulk', action='store_true', help="save with BulkStore")
+    parser.add_argument('--stream', action='store_true', help="read CSV data sources row by row")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--dry-run', action='store_true', help="check the dataset without writing anything")
+    parser.add_argument('--stats', metavar='FILE', help="write the LoadStats report to FILE")
+    args = parser.parse_args(argv)
+
+    if args.settings:
+        os.environ['DJANGO_SETTINGS_MODULE'] = args.settings
+
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+    from dock.core.incoming import Unload, IncrementalUnload, Process, Store, BulkStore, LoadStats
+
+    if args.incremental:
+        unload = IncrementalUnload(args.data_root, manifest_file=args.manifest)
+    else:
+        unload = Unload(args.data_root, manifest_file=args.manifest)
+
+    inventory = unload.map_inventory()
+    startup = time.time() - STARTED
+    start = time.time()
+
+    process = Process(inventory,
+                      storage_class=BulkStore if args.bulk else Store,
+                      stream=args.stream,
+                      workers=args.workers,
+                      manifest=unload.manifest,
+                      stats=LoadStats(report_file=args.stats) if args.stats else None,
+                      dry_run=args.dry_run)
+
+    if args.incremental and not args.dry_run:
+        unload.commit()
+
+    print('startup %.2fs, load %.2fs, %s data sources' % (startup, time.time() - start, len(inventory)),
+          file=sys.stderr)
+
+    if args.dry_run:
+        print(json.dumps(process.validation.report(), indent=2))
+        return 0 if process.validation.valid else 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,3 +5,30 @@ DOCK_DIRECT_RELATION_TYPES = ['ManyToManyField', 'ForeignKey', 'OneToOneField']
 DOCK_HEADER_ARGS_SEPARATOR = '*'
 
 DOCK_FIELD_ARGS_SEPARATOR = ';'
+
+DOCK_BULK_BATCH_SIZE = 500
+
+DOCK_LOOKUP_CACHE_SIZE = 10000
+
+DOCK_IDENTITY_MAP_SIZE = 10000
+
+DOCK_BULK_UPDATE_SIZE = 250
+
+DOCK_EXPORT_CHUNK_SIZE = 2000
+
+DOCK_PARSER_CHUNK_SIZE = 10000
+
+DOCK_VALIDATION_CHUNK_SIZE = 500
+
+DOCK_PIPELINE_CHUNK_SIZE = 1000
+
+DOCK_PIPELINE_QUEUE_SIZE = 8
+
+DOCK_PROCESSOR_BATCH_SIZE = 1000
+
+# in bytes; smaller data sources are not worth a pool of processes
+DOCK_SHARD_MIN_SIZE = 1024 * 1024
+
+DOCK_COERCED_FIELD_TYPES = ['IntegerField', 'BigIntegerField', 'SmallIntegerField', 'PositiveIntegerField',
+                            'PositiveSmallIntegerField', 'FloatField', 'DecimalField', 'BooleanField',
+                            'NullBooleanField', 'DateField', 'DateTimeField', 'TimeField']
@@ -1,12 +1,80 @@
 import os
+import sys
+import csv
 import json
-from itertools import chain
-import tablib
-from django.db.models.loading import get_model
-from django.db.models.fields import FieldDoesNotExist
-from django.core.exceptions import FieldError
+import time
+import errno
+import marshal
+import hashlib
+import Queue
+import threading
+import traceback
+import subprocess
+try:
+    import resource
+except ImportError:
+    resource = None
+from StringIO import StringIO
+from contextlib import contextmanager
+from itertools import islice, compress
+from decimal import Decimal
+from importlib import import_module
+from collections import OrderedDict, Counter
 from dock import config
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class _Lazy(object):
+    """
+    Django, tablib and the other heavy modules, imported the first time they
+    are used, so that importing dock is cheap. Each name is imported once and
+    then set on the instance, so later lookups are plain attribute access.
+
+    """
+
+    names = {
+        'models': ('django.db.models', None),
+        'connections': ('django.db', 'connections'),
+        'router': ('django.db', 'router'),
+        'transaction': ('django.db', 'transaction'),
+        'reset_queries': ('django.db', 'reset_queries'),
+        'Case': ('django.db.models', 'Case'),
+        'When': ('django.db.models', 'When'),
+        'Value': ('django.db.models', 'Value'),
+        'F': ('django.db.models', 'F'),
+        'Max': ('django.db.models', 'Max'),
+        'FieldDoesNotExist': ('django.db.models.fields', 'FieldDoesNotExist'),
+        'FieldError': ('django.core.exceptions', 'FieldError'),
+        'ValidationError': ('django.core.exceptions', 'ValidationError'),
+        'django_get_model': ('django.db.models.loading', 'get_model'),
+        'tablib': ('tablib', None),
+        'multiprocessing': ('multiprocessing', None),
+        'sqlite3': ('sqlite3', None),
+    }
+
+    def __getattr__(self, name):
+
+        try:
+            module_name, attr = self.names[name]
+        except KeyError:
+            raise AttributeError(name)
+
+        value = import_module(module_name)
+        if attr is not None:
+            value = getattr(value, attr)
+        setattr(self, name, value)
+        return value
+
+
+lazy = _Lazy()
+
 
 class Store(object):
 
@@ -15,14 +83,33 @@ class Store(object):
     Can be subclassed to provide custom save methods following the
     convention of _save_{model_name_lower_case}
 
+    Related instances are looked up in `identity_map` first, if there is one,
+    and the instances this store creates are added to it.
+
+    With a `deferred` list, references of the model to itself that can't be
+    resolved yet, because they point further down the data source, don't
+    fail: foreign keys are left empty (if the field allows it) and many to
+    many values are left out, and each is appended to `deferred` as a tuple
+    of (instance, field, value, header_args), for Process to fix up once the
+    whole dataset is saved.
+
     """
 
-    def __init__(self, model, obj):
+    # a LoadPlan per model, shared by all stores
+    _plans = {}
+
+    def __init__(self, model, obj, lookup_cache=None, stats=None, identity_map=None, deferred=None):
 
         self.model = model
         self.obj = obj
+        self.lookup_cache = lookup_cache
+        self.stats = stats
+        self.identity_map = identity_map
+        self.deferred = deferred
         self.direct_relation_types = config.DOCK_DIRECT_RELATION_TYPES
         self.lookup_fields = config.DOCK_RELATION_LOOKUP_FIELDS
+        # the references the last prepared object defers, as (field, value, header_args)
+        self._unresolved = []
 
     def save(self):
 
@@ -39,42 +126,94 @@ class Store(object):
     def _save_base(self, prepare=True, **obj):
 
         related = None
+        stats = self.stats
 
         if prepare:
+            if stats is not None:
+                start = time.time()
+
             obj, related = self._prepare_obj(**obj)
 
-        # by convention, if we have a value for ID,
-        # we expect to be able to retrieve that object.
+            if stats is not None:
+                stats.add(self.model, 'prepare', time.time() - start)
+
+        if stats is not None:
+            start = time.time()
+
+        # by convention, a value for ID means an update of an existing object,
+        # or an insert with that ID when there is none, as in BulkStore.
+        instance = None
+        existed = False
         if 'id' in obj and obj['id']:
             try:
                 instance = self.model.objects.get(pk=obj['id'])
-                # TODO: won't work for related
-                for k, v in obj.iteritems():
-                    instance[k] = v
+                existed = True
+                changed = self._changed_fields(instance, obj)
 
-                instance.save()
+                # an unchanged object is not written at all
+                if changed:
+                    instance.save(update_fields=[field.name for field in changed])
 
-            except self.model.DoesNotExist as e:
-                raise e
+            except self.model.DoesNotExist:
+                pass
 
-        else:
+        if instance is None:
             instance = self.model.objects.create(**obj)
 
+            if self.identity_map is not None:
+                self.identity_map.add(self.model, instance)
+
+        if self._unresolved:
+            self._defer(instance)
+
         if related:
             for r in related:
 
                 if r[1] == 'ManyToManyField':
-                    r[0].add(*r[2])
+                    getattr(instance, r[0].name).add(*r[2])
 
                 elif r[1] == 'ReverseForeignKey':
+                    known = set()
+
+                    # like many to many relations, those an existing object already has are left alone
+                    if existed:
+                        known = set(unicode(value) for value in r[0].objects.filter(**{
+                            r[4]: instance
+                        }).values_list(r[3], flat=True))
+
                     for a in r[2]:
+                        if unicode(a) in known:
+                            continue
+
                         obj_dict = {}
-                        obj_dict[self.model.__name__.lower()] = self.model
+                        obj_dict[r[4]] = instance
                         obj_dict[r[3]] = a
                         r[0].objects.create(**obj_dict)
 
+        if stats is not None:
+            stats.add(self.model, 'save', time.time() - start)
+
         return instance
 
+    def _changed_fields(self, instance, obj):
+        """Set the values of a prepared object on `instance`, and return the fields that changed."""
+
+        changed = []
+
+        for name, value in obj.iteritems():
+            field = self.model._meta.get_field(name)
+
+            if isinstance(value, lazy.models.Model):
+                value = value.pk
+            else:
+                value = field.to_python(value)
+
+            if getattr(instance, field.attname) != value:
+                setattr(instance, field.attname, value)
+                changed.append(field)
+
+        return changed
+
     # THE TEMPLATE FOR HOW A CUSTOM SAVE METHOD SHOULD LOOK
     # def _save_{model_name_lower_case}(self, prepare=True, **obj):
     #
@@ -93,92 +232,132 @@ class Store(object):
 
     def _prepare_obj(self, **obj):
 
+        plan = self._plans.get(self.model)
+        if plan is None:
+            plan = self._plans[self.model] = LoadPlan(self.model, self.direct_relation_types)
+
+        prepared = {}
         related = []
+        self._unresolved = []
 
-        for header in obj.keys():
+        for header, value in obj.iteritems():
+            field_name, internal_type, target, header_args = plan.column(header)
 
-            related_model = None
-            header_args = []
-            related_values = []
+            if internal_type is None:
+                prepared[field_name] = value
 
-            # first, if we have args in the header, split them out
-            if config.DOCK_HEADER_ARGS_SEPARATOR in header:
-                header, header_args = header.split(config.DOCK_HEADER_ARGS_SEPARATOR)
-                header_args = header_args.split(config.DOCK_FIELD_ARGS_SEPARATOR)
-                # TODO: improve the way we take args add add them for lookups. should be namespaced
-                # TODO: also, try the accessor syntax from django `model__field_name`
+            elif internal_type == 'ManyToManyField':
+                # TODO: We need to know fit he m2m has a through table
+                related_values = []
 
-            # then, we'll do some introspection on our target model fields,
-            # so we can treat related field types distinctly
-            try:
-                # If the field is actually defined on the class, we'll get the related_model like this
-                model_field = self.model._meta.get_field(header)
-                internal_type = model_field.get_internal_type()
+                # numbers read from JSON or Excel are not strings
+                for v in unicode(value).split(config.DOCK_FIELD_ARGS_SEPARATOR):
+                    instance = self._find_or_defer(target, v, header_args)
+                    if instance is not None:
+                        related_values.append(instance)
+
+                # related is a list of tuples. enough for us to save the related objects later
+                if related_values:
+                    related.append((target, internal_type, related_values))
 
-                if internal_type in self.direct_relation_types:
-                    related_model = model_field.rel.to
+            elif internal_type == 'ReverseForeignKey':
+                # TODO: We assume here that the related instance exists. maybe we wanted to create it
+                # the related model, and the name of its foreign key to our model
+                related_values = unicode(value).split(config.DOCK_FIELD_ARGS_SEPARATOR)
+                related.append((target.related_model, internal_type, related_values, header_args[0],
+                                target.field.name))
 
-                    # if the field is an m2m we need to extract the multi-value arguments
-                    if internal_type == 'ManyToManyField':
-                        # TODO: We need to know fit he m2m has a through table
-                        related_values = header.split(config.DOCK_FIELD_ARGS_SEPARATOR)
-                        # then, we get instances for those args
-                        for index, value in enumerate(related_values):
-                            related_values[index] = self._find_instance(related_model, value,
-                                                                        extra_lookups=[header_args[0]])
+            # a foreign key, or a one to one, unless a custom save method already found the instance
+            elif isinstance(value, lazy.models.Model):
+                prepared[field_name] = value
 
-                        # related is a list of tuples. enough for us to save the related objects later
-                        related.append((model_field, internal_type, related_values))
+            else:
+                instance = self._find_or_defer(target, value, header_args)
+                if instance is not None:
+                    prepared[field_name] = instance
 
-                        del obj[header]
+        return prepared, related
 
-                else:
-                    # TODO: handle this
-                    pass
+    def _find_or_defer(self, field, value, header_args):
+        """Find the related instance for `value`, or defer a reference of the model to itself."""
 
-            except FieldDoesNotExist as e:
-                # TODO: We assume here that the related instance exists. maybe we wanted to create it
-                # The field was not on the class, it is a reverse relation in the ORM
-                try:
-                    model_field = getattr(self.model, header)
-                    related_model = model_field.related.model
+        try:
+            return self._find_instance(field.rel.to, value, extra_lookups=header_args)
 
-                except AttributeError as e:
-                    #TODO: we actually are raising here when the try/except it is wrapped in
-                    # also fails, and thus the user cant know which error to debug
-                    raise e
+        except field.rel.to.DoesNotExist:
+            # only the objects further down the dataset we are saving can still show up
+            if self.deferred is None or field.rel.to is not self.model or \
+                    (field.get_internal_type() != 'ManyToManyField' and not field.null):
+                raise
 
-                if related_model:
-                    # TODO: support other reverse relations
-                    internal_type = 'ReverseForeignKey'
-                    related_values = header.split(config.DOCK_FIELD_ARGS_SEPARATOR)
-                    # then, we get instances for those args
-                    #for index, value in enumerate(related_args):
-                    #    #hmmm, should be create instance, but only after we have an instance of the main model
-                    #    related_args[index] = self._find_instance(related_model, value, extra_lookups=[header_args])
+            self._unresolved.append((field, value, header_args))
 
-                    # related is a list of tuples. enough for us to save the related objects later
-                    related.append((related_model, internal_type, related_values, header_args[0]))
+    def _defer(self, instance):
 
-        return obj, related
+        self.deferred.extend((instance, field, value, header_args) for field, value, header_args in self._unresolved)
+        self._unresolved = []
 
     def _find_instance(self, model, value, extra_lookups=None):
         """Using a try/except loop with a lookup table, try to find a model instance."""
 
-        lookups = self.lookup_fields
+        if self.stats is None:
+            return self._lookup_instance(model, value, extra_lookups)
+
+        start = time.time()
+
+        try:
+            return self._lookup_instance(model, value, extra_lookups)
+        finally:
+            self.stats.add(self.model, 'lookup', time.time() - start)
+
+    def _lookup_instance(self, model, value, extra_lookups):
+
+        # lookups named in the header come first, so a value is matched by
+        # the field the data source says it holds before any other
+        lookups = list(extra_lookups or ())
+        lookups.extend(lookup for lookup in self.lookup_fields if lookup not in lookups)
         success = False
         instance = None
 
-        if extra_lookups:
-            lookups.extend(extra_lookups)
-
         for lookup in lookups:
+
+            # created earlier in this run, no need to ask
+            if self.identity_map is not None:
+                instance = self.identity_map.get(model, lookup, value)
+                if instance is not None:
+                    success = True
+                    break
+
+            if self.lookup_cache is not None:
+                found, cached = self.lookup_cache.get(model, lookup, value)
+
+                if found:
+                    # misses are cached as the exception the lookup raised
+                    if isinstance(cached, Exception):
+                        e = cached
+                        continue
+
+                    instance = cached
+                    success = True
+                    break
+
             try:
                 instance = model.objects.get(**{lookup: value})
                 success = True
-                break
-            except (FieldError, model.DoesNotExist) as e:
-                pass
+            except ValueError:
+                # a value the field can't hold, like a name for `id`, matches nothing
+                e = model.DoesNotExist('%s matching %s=%s does not exist.' % (model.__name__, lookup, value))
+                if self.lookup_cache is not None:
+                    self.lookup_cache.set(model, lookup, value, e)
+                continue
+            except (lazy.FieldError, model.DoesNotExist) as e:
+                if self.lookup_cache is not None:
+                    self.lookup_cache.set(model, lookup, value, e)
+                continue
+
+            if self.lookup_cache is not None:
+                self.lookup_cache.set(model, lookup, value, instance)
+            break
 
         if not success:
             # raising here so our loop above executes as desired
@@ -188,204 +367,2854 @@ class Store(object):
         return instance
 
 
-class Process(object):
+class LoadPlan(object):
 
-    """Takes data, as list of tuples, validates, and saves to the data store.
+    """How to prepare the objects of a model for Store, compiled once per header.
 
-    Each tuple passed in the list has the following signature:
+    For each header, the plan records a tuple of the field name, the internal
+    type of the field when it is a relation (or None), the model field (the
+    relation, for a reverse relation), and the lookup args from the header. Preparing an object then
+    needs no header parsing and no model introspection.
 
-    (model, data_source)
+    """
 
-    Where:
+    def __init__(self, model, direct_relation_types):
 
-    * *module* describes a python module in the project that holds *model*
-    * *data_source* is the file with data for *model*
+        self.model = model
+        self.direct_relation_types = direct_relation_types
+        self.columns = {}
+        self.coercers = {}
 
-    """
+    def column(self, header):
+
+        try:
+            return self.columns[header]
+        except KeyError:
+            column = self.columns[header] = self._compile(header)
+            return column
 
-    def __init__(self, inventory, storage_class=Store, dataset_processing_class=None):
+    def coercer(self, header):
+        """Returns the function that converts values of `header` to their python type, or None.
 
-        if not isinstance(inventory, (list, tuple)):
-            raise AssertionError("Store requires inventory as a list or a tuple, you passed neither.")
+        Only fields with an internal type in DOCK_COERCED_FIELD_TYPES are converted.
+        Headers that are not fields of the model are left for Store to complain about.
 
-        if dataset_processing_class:
-            if not isinstance(dataset_processing_class, type):
-                raise AssertionError("Dataset Processor must be a class")
+        """
 
-            if not hasattr(dataset_processing_class, 'processed'):
-                raise AssertionError("Dataset Processor must have a callable attribute named `processed`")
+        try:
+            return self.coercers[header]
+        except KeyError:
+            pass
 
-        self.inventory = inventory
-        self.storage_class = storage_class
+        try:
+            field_name, internal_type, model_field, header_args = self.column(header)
+        except (AttributeError, AssertionError):
+            model_field = None
 
-        # `self.dataset_processing_class` is implemented to allow processing of the dataset as a whole,
-        # for example, validations on the whole set, extracting additional datasets
-        # out of the passed dataset, and so on.
-        self.dataset_processing_class = dataset_processing_class
-        self.save()
+        coerce = None
+        if model_field is not None and internal_type is None and \
+                model_field.get_internal_type() in config.DOCK_COERCED_FIELD_TYPES:
+            coerce = model_field.to_python
 
-    def processed(self):
-        """Extract data from the source files, clean headers and rows, and return a list of (model, dataset) tuples."""
+        self.coercers[header] = coerce
+        return coerce
 
-        processed = []
+    def _compile(self, header):
 
-        for item in self.inventory:
-            model, data_source = item
-            dataset_raw = self._extract_data(data_source)
-            dataset_clean = self._clean_data(dataset_raw)
-            processed.append((model, dataset_clean))
+        field_name = header
+        header_args = []
 
-        if self.dataset_processing_class:
-            # We'll send processed as the first argument of whatever class we are given
-            # We expect that class to implement a processed method that returns an ordered
-            # list of (model, dataset) tuples, just list Process.processed
-            dataset_processor = self.dataset_processing_class(processed)
-            processed = dataset_processor.processed()
+        # first, if we have args in the header, split them out
+        if config.DOCK_HEADER_ARGS_SEPARATOR in header:
+            field_name, header_args = header.split(config.DOCK_HEADER_ARGS_SEPARATOR)
+            header_args = header_args.split(config.DOCK_FIELD_ARGS_SEPARATOR)
+            # TODO: improve the way we take args add add them for lookups. should be namespaced
+            # TODO: also, try the accessor syntax from django `model__field_name`
 
-        return processed
+        # then, we'll do some introspection on our target model fields,
+        # so we can treat related field types distinctly
+        try:
+            model_field = self.model._meta.get_field(field_name)
 
-    def save(self):
-        """Unpack our processed data and pass each object to storage class for saving."""
+        except lazy.FieldDoesNotExist:
+            # a reverse relation by the name of its accessor, like `note_set`
+            model_field = getattr(getattr(self.model, field_name, None), 'related', None)
 
-        for item in self.processed():
-            model, dataset = item
-            for obj in dataset:
-                store = self.storage_class(model, obj)
-                obj = store.save()
+            if model_field is None:
+                raise AttributeError("%s has no field or relation named `%s`." % (self.model.__name__, field_name))
 
-    def _extract_data(self, data_source):
-        """Create a Dataset object from the data source."""
+        if model_field.auto_created and not model_field.concrete:
+            # the field is not on the class, it is a reverse relation in the ORM
 
-        with open(data_source) as f:
-            stream = f.read()
-            raw_dataset = tablib.import_set(stream)
+            # TODO: support other reverse relations
+            if not model_field.one_to_many:
+                raise AssertionError("The header `%s` is a reverse relation other than a foreign key, "
+                                     "which can't be set from %s." % (header, self.model.__name__))
 
-        return raw_dataset
+            if not header_args:
+                raise AssertionError("The reverse relation header `%s` needs the name of the field to set "
+                                     "on the related model, like `%s%sname`."
+                                     % (header, field_name, config.DOCK_HEADER_ARGS_SEPARATOR))
 
-    def _clean_data(self, raw_dataset):
-        """Takes the raw Dataset and cleans it up."""
+            return field_name, 'ReverseForeignKey', model_field, header_args
 
-        dataset_clean_headers = self._normalize_headers(raw_dataset)
-        dataset_clean = self._normalize_rows(dataset_clean_headers)
+        internal_type = model_field.get_internal_type()
 
-        return dataset_clean
+        if internal_type in self.direct_relation_types:
+            return field_name, internal_type, model_field, header_args
 
-    def _normalize_headers(self, dataset):
-        """Clean up the headers of each Dataset."""
+        return field_name, None, model_field, header_args
 
-        symbols = {
-            # Note: We are now allowing the "_" symbol which is valid in python vars.
-            ord('-'): None,
-            ord('"'): None,
-            ord(' '): None,
-            ord("'"): None,
+
+class LookupCache(object):
+
+    """Caches related instances found by Store._find_instance, for the run of a Process.
+
+    Entries are keyed by (model, lookup field, value), and the least recently
+    used entries are evicted once there are more than `max_size`. Lookups that
+    found nothing are cached too, so a missing value is only queried once.
+
+    With `prefetch=True`, the first lookup on a related model loads all of its
+    instances in one query, and indexes them by every lookup field; all further
+    lookups on that model are then answered without a query.
+
+    The cache can be shared by the worker threads of a concurrent Process.
+
+    """
+
+    def __init__(self, max_size=None, prefetch=False, lookup_fields=None):
+
+        self.max_size = max_size or config.DOCK_LOOKUP_CACHE_SIZE
+        self.prefetch = prefetch
+        self.lookup_fields = lookup_fields or config.DOCK_RELATION_LOOKUP_FIELDS
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def get(self, model, lookup, value):
+        """Return a (found, instance) tuple for the lookup."""
+
+        with self._lock:
+            return self._get(model, lookup, value)
+
+    def _get(self, model, lookup, value):
+
+        if self.prefetch:
+            index = self._indexes.get(model)
+            if index is None:
+                index = self._indexes[model] = self._build_index(model)
+
+            # values that are not in a prefetched index don't exist, we don't need to ask
+            if lookup in index:
+                self.hits += 1
+                instance = index[lookup].get(unicode(value))
+                if instance is None:
+                    return True, model.DoesNotExist('%s matching %s=%s does not exist.'
+                                                    % (model.__name__, lookup, value))
+                return True, instance
+
+        key = (model, lookup, unicode(value))
+
+        try:
+            instance = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return False, None
+
+        # re-inserting moves the entry to the most recently used end
+        self._entries[key] = instance
+        self.hits += 1
+        return True, instance
+
+    def set(self, model, lookup, value, instance):
+
+        with self._lock:
+            self._entries[(model, lookup, unicode(value))] = instance
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model):
+        """Forget everything about `model`, for example because we are about to save more of it."""
+
+        with self._lock:
+            self._indexes.pop(model, None)
+
+            for key in [key for key in self._entries if key[0] is model]:
+                del self._entries[key]
+
+    def stats(self):
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'prefetched': sorted(model.__name__ for model in self._indexes),
         }
 
-        for index, header in enumerate(dataset.headers):
-            tmp = unicode(header).translate(symbols).lower()
-            dataset.headers[index] = tmp
+    def _build_index(self, model):
+        """Load all instances of `model` in one query, and index them by each lookup field they have."""
 
-        return dataset
+        field_names = set(field.name for field in model._meta.fields)
+        lookups = [lookup for lookup in self.lookup_fields if lookup == 'pk' or lookup in field_names]
+        index = dict((lookup, {}) for lookup in lookups)
 
-    def _normalize_rows(self, dataset):
-        """Clean up each object in the Dataset."""
+        for instance in model.objects.all():
+            for lookup in lookups:
+                value = getattr(instance, lookup)
+                if value is not None:
+                    index[lookup].setdefault(unicode(value), instance)
 
-        dataset = dataset.dict
+        return index
 
-        for item in dataset:
-            for k, v in item.iteritems():
-                if not v:
-                    del item[k]
 
-        return dataset
+class IdentityMap(object):
 
+    """The instances created during the run of a Process, by model, lookup field and value.
 
-class Unload(object):
+    Instances are indexed by each of the lookup fields that is a concrete, non
+    relation field of their model, and by `pk`, so references to objects that
+    were loaded earlier in the same run are resolved without a query. Only
+    instances that have a primary key are kept, and the least recently used
+    entries are evicted once there are more than `max_size`, so the map does
+    not grow with the dataset.
 
-    """Extracts a full dataset from a path, and sorts the data for further processing.
+    The map can be shared by the worker threads of a concurrent Process.
 
-    Unload walks the dataset directories, top down, from a root directory.
+    """
 
-    Using the index files, which declare the *order* that the data should
-    eventually be loaded, and file + directory naming conventions, which
-    declare the modules and models that the data is intended for, we
-    return a list of tuples, where each tuple has the target Model, and the
-    path to the data for that model.
+    def __init__(self, max_size=None, lookup_fields=None):
 
-    This list is returned by the `freight` method, and is intended to be consumed
-    by the Process class, which further processed the data and prepares it for
-    saving to the data store.
+        self.max_size = max_size or config.DOCK_IDENTITY_MAP_SIZE
+        self.lookup_fields = lookup_fields or config.DOCK_RELATION_LOOKUP_FIELDS
+        self.hits = 0
+        self._instances = OrderedDict()
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+    def add(self, model, instance):
+
+        if instance.pk is None:
+            return
+
+        lookups = self._lookups.get(model)
+        if lookups is None:
+            field_names = set(field.name for field in model._meta.fields if not field.rel)
+            lookups = self._lookups[model] = [lookup for lookup in self.lookup_fields
+                                              if lookup == 'pk' or lookup in field_names]
+
+        with self._lock:
+            for lookup in lookups:
+                value = getattr(instance, lookup)
+                if value is not None:
+                    key = (model, lookup, unicode(value))
+                    self._instances.pop(key, None)
+                    self._instances[key] = instance
+
+            while len(self._instances) > self.max_size:
+                self._instances.popitem(last=False)
+
+    def get(self, model, lookup, value):
+        """Return the instance for the lookup, or None."""
+
+        key = (model, lookup, unicode(value))
+
+        with self._lock:
+            try:
+                instance = self._instances.pop(key)
+            except KeyError:
+                return None
+
+            # re-inserting moves the entry to the most recently used end
+            self._instances[key] = instance
+            self.hits += 1
+
+        return instance
+
+    def __len__(self):
+
+        return len(self._instances)
+
+
+class BulkStore(Store):
+
+    """Takes a model and an iterable of objects, and saves them to the data store in batches.
+
+    Objects are accumulated and inserted with one query per `batch_size`
+    objects. Many to many and reverse foreign key relations are deferred,
+    and written in a second batched pass once the objects of a batch exist,
+    with one insert per related model.
+
+    Objects with an ID are upserted: the objects of a batch that already exist
+    are fetched in one query, and only the fields that changed are updated,
+    with one query per DOCK_BULK_UPDATE_SIZE objects. Objects that did not
+    change are not written.
+
+    Models with a custom _save_{model_name_lower_case} method are saved
+    object by object through that method, exactly like with Store.
+
+    The instances of a batch are added to `identity_map` once it is saved,
+    and references are deferred like with Store.
 
     """
 
-    def __init__(self, data_root, ignore_dirs=('assets',), index_file='index.json', supported_extensions=('.csv',)):
+    # Process checks this flag to hand over a whole dataset instead of single objects
+    bulk = True
 
-        self.data_root = data_root
-        self.ignore_dirs = set(ignore_dirs)
-        self.index_file = index_file
-        self.supported_extensions = supported_extensions
-        self.root_index = os.path.abspath(os.path.join(self.data_root, index_file))
+    def __init__(self, model, objs, batch_size=None, lookup_cache=None, stats=None, identity_map=None,
+                 deferred=None):
 
-    def extract_sources(self):
-        """Returns a list of data sources, ordered by desired save order."""
+        super(BulkStore, self).__init__(model, None, lookup_cache=lookup_cache, stats=stats,
+                                        identity_map=identity_map, deferred=deferred)
+        self.objs = objs
+        self.batch_size = batch_size or config.DOCK_BULK_BATCH_SIZE
 
-        ordered_branches = []
-        ordered_sources = []
-        sources = []
+    def save(self):
+        """Save all objects, and return the number of objects saved."""
 
-        for root, dirs, files in os.walk(self.data_root):
+        custom_save = getattr(self, '_save_' + self.model.__name__.lower(), None)
+        count = 0
+        batch = []
 
-            # only consider roots that have an index file
-            if self.index_file in files:
-                root_index = os.path.join(root, self.index_file)
+        for obj in self.objs:
+            count += 1
 
-                with open(root_index) as f:
-                    index = dict(json.load(f))
-                    # get the ordering for this scope
-                    index = index['ordering']
+            if custom_save:
+                custom_save(**obj)
+                if self.stats is not None:
+                    self.stats.add_queries(self.model)
+                continue
 
-                    # TODO: handle case of directory and file in same scope with the same name
-                    # TODO: handle case of two files with the same name and different supported extensions
-                    # TODO: Check the implementation for multiple nested directories and rewrite accordingly
-                    for entry in index:
-                        entry_path = os.path.join(root, entry)
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                self._save_batch(batch)
+                batch = []
 
-                        # build an ordered list of data branches from the indexed directories
-                        if os.path.exists(entry_path) and entry_path not in ordered_branches:
-                            ordered_branches.append(entry_path)
+        if batch:
+            self._save_batch(batch)
 
-                        # build a list of data sources, from the indexed files
-                        for ext in self.supported_extensions:
-                            source_path = entry_path + ext
-                            if os.path.exists(source_path):
-                                sources.append(source_path)
+        return count
 
-        ordered_sources.extend(ordered_branches)
+    def _save_batch(self, objs):
 
-        # each ordered branch will be replaced with an ordered list of the files it contains
-        for index, branch in enumerate(ordered_sources):
-            ordered_sources[index] = [source for source in sources if source.startswith(branch)]
+        instances = []
+        pending = []
+        upserts = []
+        unresolved = []
+        stats = self.stats
 
-        # return a flattened list that is ordered for loading to the data store
-        return list(chain.from_iterable(ordered_sources))
+        if stats is not None:
+            start = time.time()
 
-    def map_inventory(self):
-        """Takes the extracted data sources, and builds a new list of tuples like (model, data_source).
+        for obj in objs:
+            obj, related = self._prepare_obj(**obj)
 
-        Getting the Model relies on a naming convention in the dataset:
-        * the data_source filename is the destination Model name, in lowercase, and the Model itself should be in title case.
-        * the data_source parent directory is the module that holds the Model
+            # by convention, a value for ID means an update of an existing object,
+            # or an insert with that ID when there is none.
+            if 'id' in obj and obj['id']:
+                upserts.append((obj, related, self._unresolved))
+                continue
+
+            instance = self.model(**obj)
+            instances.append(instance)
+
+            if related:
+                pending.append((instance, related))
+
+            if self._unresolved:
+                unresolved.append((instance, self._unresolved))
+
+        updates, existing = self._split_upserts(upserts, instances, pending, unresolved)
+
+        if stats is not None:
+            stats.add(self.model, 'prepare', time.time() - start)
+            start = time.time()
+
+        if instances:
+            self._insert(instances, bool(pending or unresolved) or self.identity_map is not None)
+
+        if updates:
+            self._save_updates(updates)
+
+        if pending:
+            self._save_related(pending, existing)
+
+        if self.identity_map is not None:
+            for instance in instances:
+                self.identity_map.add(self.model, instance)
+
+        for instance, self._unresolved in unresolved:
+            self._defer(instance)
+
+        if stats is not None:
+            stats.add(self.model, 'save', time.time() - start)
+            stats.add_queries(self.model)
+
+    def _insert(self, instances, need_pks):
+        """Insert the instances with bulk_create, and set their primary keys, if we `need_pks`.
+
+        Before Django 1.10, bulk_create does not set the primary keys of the
+        instances it inserts. They are read back in the same transaction: the
+        rows after the highest primary key there was before the insert, in
+        order, are the instances we inserted without one. This assumes nothing
+        else inserts into the table while we load it.
 
         """
 
-        inventory = []
+        using = lazy.router.db_for_write(self.model)
+        manager = self.model._base_manager.db_manager(using)
+        need_pks = need_pks and self.model._meta.has_auto_field
+        last = None
 
-        for data_source in self.extract_sources():
-            full_path, ext = os.path.splitext(data_source)
-            head, model_name = os.path.split(full_path)
-            head, module_name = os.path.split(head)
-            # TODO: Remove django's get model with a wrapper that will do the same for whatever backend
-            model = get_model(module_name, model_name.title())
-            inventory.append((model, data_source))
+        with lazy.transaction.atomic(using=using):
+            if need_pks:
+                last = manager.aggregate(last=lazy.Max('pk'))['last']
 
-        return inventory
+            manager.bulk_create(instances, batch_size=self.batch_size)
+            missing = [instance for instance in instances if instance.pk is None]
+
+            if need_pks and missing:
+                given = set(instance.pk for instance in instances if instance.pk is not None)
+                queryset = manager.order_by('pk')
+                if last is not None:
+                    queryset = queryset.filter(pk__gt=last)
+
+                pks = [pk for pk in queryset.values_list('pk', flat=True) if pk not in given]
+
+                if len(pks) != len(missing):
+                    raise AssertionError("Inserted %s objects of %s, but found %s new rows. Something else "
+                                         "inserted into its table during the load."
+                                         % (len(missing), self.model.__name__, len(pks)))
+
+                for instance, pk in zip(missing, pks):
+                    instance.pk = pk
+
+        for instance in instances:
+            instance._state.adding = False
+            instance._state.db = using
+
+    def _split_upserts(self, upserts, instances, pending, unresolved):
+        """Find which of the objects with an ID exist, with one query.
+
+        Objects that don't exist are added to `instances`, for inserting. For those
+        that do, returns the changed values as {field: {pk: value}}, and the set of
+        their primary keys.
+
+        """
+
+        updates = OrderedDict()
+        existing = set()
+
+        if not upserts:
+            return updates, existing
+
+        pk_field = self.model._meta.pk
+        instances_by_pk = self.model.objects.in_bulk([pk_field.to_python(obj['id']) for obj, related, references in upserts])
+
+        for obj, related, references in upserts:
+            pk = pk_field.to_python(obj['id'])
+            instance = instances_by_pk.get(pk)
+
+            if instance is None:
+                instance = self.model(**obj)
+                instance.pk = pk
+                instances.append(instance)
+
+            else:
+                existing.add(pk)
+                for field in self._changed_fields(instance, obj):
+                    updates.setdefault(field, OrderedDict())[pk] = getattr(instance, field.attname)
+
+            if related:
+                pending.append((instance, related))
+
+            if references:
+                unresolved.append((instance, references))
+
+        return updates, existing
+
+    def _save_updates(self, updates):
+        """Write the changed values with one query per DOCK_BULK_UPDATE_SIZE objects.
+
+        `updates` maps fields to {pk: value}. Each query sets every changed field
+        of its objects; a field an object did not change keeps its value.
+
+        """
+
+        pks = list(OrderedDict.fromkeys(pk for values in updates.itervalues() for pk in values))
+
+        for offset in range(0, len(pks), config.DOCK_BULK_UPDATE_SIZE):
+            chunk = pks[offset:offset + config.DOCK_BULK_UPDATE_SIZE]
+            changes = {}
+
+            for field, values in updates.iteritems():
+                cases = [lazy.When(pk=pk, then=lazy.Value(values[pk])) for pk in chunk if pk in values]
+                if cases:
+                    changes[field.attname] = lazy.Case(*cases, default=lazy.F(field.attname), output_field=field)
+
+            self.model.objects.filter(pk__in=chunk).update(**changes)
+
+    def _save_related(self, pending, existing=()):
+        """Write the deferred relations of a batch, with one insert per related model.
+
+        For the primary keys in `existing`, relations that are already in the data
+        store are left alone, at the cost of one more query per relation.
+
+        """
+
+        related_objs = OrderedDict()
+        known = {}
+
+        for instance, related in pending:
+            for r in related:
+
+                if r[1] == 'ManyToManyField':
+                    through = r[0].rel.through
+
+                    if instance.pk in existing and r[0] not in known:
+                        known[r[0]] = set(through.objects.filter(**{
+                            r[0].m2m_field_name() + '__in': existing
+                        }).values_list(r[0].m2m_field_name(), r[0].m2m_reverse_field_name()))
+
+                    for value in r[2]:
+                        if (instance.pk, value.pk) in known.get(r[0], ()):
+                            continue
+
+                        related_objs.setdefault(through, []).append(through(**{
+                            r[0].m2m_column_name(): instance.pk,
+                            r[0].m2m_reverse_name(): value.pk,
+                        }))
+
+                elif r[1] == 'ReverseForeignKey':
+                    key = (r[0], r[3])
+                    fk_name = r[4]
+
+                    if instance.pk in existing and key not in known:
+                        known[key] = set((pk, unicode(value)) for pk, value in r[0].objects.filter(**{
+                            fk_name + '__in': existing
+                        }).values_list(fk_name, r[3]))
+
+                    for a in r[2]:
+                        if (instance.pk, unicode(a)) in known.get(key, ()):
+                            continue
+
+                        obj_dict = {}
+                        obj_dict[fk_name] = instance
+                        obj_dict[r[3]] = a
+                        related_objs.setdefault(r[0], []).append(r[0](**obj_dict))
+
+        for model, objs in related_objs.iteritems():
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+
+class StorageAdapter(object):
+
+    """Where Unload gets its models from, and where Process writes the objects of a dataset to.
+
+    Subclasses implement `get_model`, to find the model for a data source by
+    the naming conventions of Unload, and `save`, which takes the Process, a
+    model and an iterable of clean objects, and returns how many objects it
+    saved.
+
+    """
+
+    def get_model(self, app_label, model_name):
+
+        raise NotImplementedError
+
+    def save(self, process, model, objs, deferred=None):
+
+        raise NotImplementedError
+
+
+class DjangoAdapter(StorageAdapter):
+
+    """Saves through the Django ORM, with the storage class of the Process, like Store or BulkStore."""
+
+    def get_model(self, app_label, model_name):
+
+        return get_model(app_label, model_name)
+
+    def save(self, process, model, objs, deferred=None):
+
+        stats = process.stats
+        storage_class = process.storage_class
+
+        # bulk storage classes take the whole dataset, and batch the writes themselves
+        if getattr(storage_class, 'bulk', False):
+            store = storage_class(model, objs, batch_size=process.batch_size, lookup_cache=process.lookup_cache,
+                                  stats=stats, identity_map=process.identity_map, deferred=deferred)
+            return store.save()
+
+        rows = 0
+        for obj in objs:
+            store = storage_class(model, obj, lookup_cache=process.lookup_cache, stats=stats,
+                                  identity_map=process.identity_map, deferred=deferred)
+            obj = store.save()
+            rows += 1
+
+            if stats is not None:
+                stats.add_queries(model)
+
+        return rows
+
+
+class DBAPIAdapter(StorageAdapter):
+
+    """Writes rows straight to the table of a model, through a DB-API connection.
+
+    Models are still Django models, for their table and column names, field
+    types and defaults, but no model instance is made, and the ORM is not
+    involved. Objects are inserted in batches of `batch_size`: with COPY when
+    the connection is psycopg2's, and with `executemany` otherwise, like for
+    a connection of the sqlite3 module. The storage class of the Process is not
+    used, and the rows are committed on `connection` at the end of each save.
+
+    This is for plain tables: the objects can only have values for concrete
+    fields that are not relations, and are always inserted, IDs or not.
+
+    """
+
+    def __init__(self, connection, batch_size=None, placeholder=None):
+
+        self.connection = connection
+        self.batch_size = batch_size or config.DOCK_BULK_BATCH_SIZE
+
+        if placeholder is None:
+            placeholder = '?' if isinstance(connection, lazy.sqlite3.Connection) else '%s'
+
+        self.placeholder = placeholder
+        self._columns = {}
+
+    def get_model(self, app_label, model_name):
+
+        return get_model(app_label, model_name)
+
+    def save(self, process, model, objs, deferred=None):
+
+        stats = process.stats
+        # rows by the headers they have, so each batch is one statement
+        batches = OrderedDict()
+        rows = 0
+        cursor = self.connection.cursor()
+
+        if stats is not None:
+            start = time.time()
+
+        try:
+            for obj in objs:
+                headers = tuple(sorted(obj))
+                batch = batches.setdefault(headers, [])
+                batch.append(obj)
+                rows += 1
+
+                if len(batch) >= self.batch_size:
+                    self._insert(cursor, model, headers, batch)
+                    del batch[:]
+
+            for headers, batch in batches.iteritems():
+                if batch:
+                    self._insert(cursor, model, headers, batch)
+
+            self.connection.commit()
+
+        finally:
+            cursor.close()
+
+        if stats is not None:
+            stats.add(model, 'save', time.time() - start)
+
+        return rows
+
+    def _insert(self, cursor, model, headers, objs):
+
+        fields, defaults = self._fields(model, headers)
+        columns = [field.column for field in fields] + [field.column for field, value in defaults]
+        default_values = [value for field, value in defaults]
+
+        values = [[self._value(field, obj[header]) for field, header in zip(fields, headers)] + default_values
+                  for obj in objs]
+
+        table = self._quote(model._meta.db_table)
+        column_list = ', '.join(self._quote(column) for column in columns)
+
+        if hasattr(cursor, 'copy_expert'):
+            buf = StringIO()
+            writer = csv.writer(buf, lineterminator='\n')
+            for row in values:
+                writer.writerow(['' if value is None else unicode(value).encode('utf-8') for value in row])
+            buf.seek(0)
+            cursor.copy_expert('COPY %s (%s) FROM STDIN WITH CSV' % (table, column_list), buf)
+
+        else:
+            cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (table, column_list,
+                                                                  ', '.join([self.placeholder] * len(columns))),
+                               values)
+
+    def _fields(self, model, headers):
+        """Returns the fields for `headers`, and (field, default) for the other fields that have a default."""
+
+        try:
+            return self._columns[(model, headers)]
+        except KeyError:
+            pass
+
+        fields = []
+        for header in headers:
+            try:
+                field = model._meta.get_field(header)
+            except lazy.FieldDoesNotExist:
+                field = None
+
+            if field is None or field.rel:
+                raise AssertionError("%s can only load plain fields, and `%s` is not one of %s. "
+                                     "Load it with DjangoAdapter." % (self.__class__.__name__, header,
+                                                                      model.__name__))
+            fields.append(field)
+
+        # the ORM fills in defaults, the database does not know about them
+        defaults = [(other, self._value(other, other.get_default())) for other in model._meta.concrete_fields
+                    if other not in fields and other.has_default()]
+
+        columns = self._columns[(model, headers)] = fields, defaults
+        return columns
+
+    def _value(self, field, value):
+
+        value = field.to_python(value)
+
+        # not every driver knows decimals
+        if isinstance(value, Decimal):
+            value = unicode(value)
+
+        return value
+
+    def _quote(self, name):
+
+        return '"%s"' % name
+
+
+class LoadStats(object):
+
+    """Collects where the time of a Process run goes, per model and per phase.
+
+    The phases are `extract` and `clean` for reading the data sources (with
+    `stream=True`, reading is all `extract`), `prepare` for Store._prepare_obj,
+    lookups included, `lookup` for Store._find_instance, `save` for writing
+    to the data store, `commit` for committing transactions, and `validate`
+    for checking datasets in a dry run.
+
+    Each of `callbacks` is called with (model, phase, seconds) whenever a phase
+    is recorded. With `count_queries=True`, the debug cursor is switched on for
+    the connections we save with, to count the queries of each model, and
+    switched back when the run finishes. With a `report_file`, the report is
+    written there as JSON when the run finishes.
+
+    A Process without stats does none of this work.
+
+    """
+
+    def __init__(self, callbacks=None, count_queries=False, report_file=None):
+
+        self.callbacks = callbacks or []
+        self.count_queries = count_queries
+        self.report_file = report_file
+        self.models = OrderedDict()
+        self.started = time.time()
+        self.finished = None
+        # (connection, force_debug_cursor before we set it), by id of the connection
+        self._debug_cursors = {}
+        self._lock = threading.Lock()
+
+    def add(self, model, phase, seconds):
+
+        with self._lock:
+            phases = self._entry(model)['phases']
+            phases[phase] = phases.get(phase, 0) + seconds
+
+        for callback in self.callbacks:
+            callback(model, phase, seconds)
+
+    def add_rows(self, model, rows):
+
+        with self._lock:
+            self._entry(model)['rows'] += rows
+
+    def merge(self, model, entry):
+        """Add the entry for `model` of another LoadStats, like the one of a shard, to ours."""
+
+        for phase, seconds in entry['phases'].iteritems():
+            self.add(model, phase, seconds)
+
+        with self._lock:
+            ours = self._entry(model)
+            ours['rows'] += entry['rows']
+
+            if ours['queries'] is not None and entry['queries'] is not None:
+                ours['queries'] += entry['queries']
+
+    def begin(self, model):
+        """Get ready to count the queries for `model`, in the current thread."""
+
+        if self.count_queries:
+            connection = lazy.connections[lazy.router.db_for_write(model)]
+
+            with self._lock:
+                self._debug_cursors.setdefault(id(connection), (connection, connection.force_debug_cursor))
+
+            connection.force_debug_cursor = True
+            lazy.reset_queries()
+
+    def add_queries(self, model):
+
+        if self.count_queries:
+            queries = len(lazy.connections[lazy.router.db_for_write(model)].queries)
+            lazy.reset_queries()
+
+            with self._lock:
+                self._entry(model)['queries'] += queries
+
+    def finish(self):
+
+        self.finished = time.time()
+
+        with self._lock:
+            for connection, force_debug_cursor in self._debug_cursors.itervalues():
+                connection.force_debug_cursor = force_debug_cursor
+            self._debug_cursors = {}
+
+        if self.report_file:
+            with open(self.report_file, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+
+    def report(self):
+
+        models = OrderedDict()
+
+        for label, entry in self.models.iteritems():
+            seconds = sum(seconds for phase, seconds in entry['phases'].iteritems() if phase != 'lookup')
+            models[label] = dict(entry, seconds=seconds,
+                                 rows_per_second=entry['rows'] / seconds if seconds else None)
+
+        peak_memory = None
+        if resource is not None:
+            # kilobytes on linux, bytes on mac
+            peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return {
+            'seconds': (self.finished or time.time()) - self.started,
+            'rows': sum(entry['rows'] for entry in self.models.itervalues()),
+            'peak_memory': peak_memory,
+            'models': models,
+        }
+
+    def _entry(self, model):
+
+        label = model._meta.app_label + '.' + model.__name__
+
+        try:
+            return self.models[label]
+        except KeyError:
+            entry = self.models[label] = {'rows': 0, 'queries': 0 if self.count_queries else None, 'phases': {}}
+            return entry
+
+
+class Validation(object):
+
+    """Checks datasets against the data store without writing, and collects every problem found.
+
+    Each row is prepared like Store would prepare it: headers that are not
+    fields of the model (or reverse relations Store can set) are reported in
+    `unknown_headers`, values that the model field does not accept in
+    `type_errors`, and foreign key and many to many values that no related
+    object can be found for in `unresolved`.
+
+    Relations are not resolved row by row. The values of each related model
+    are collected over the dataset, and resolved with one query per lookup
+    field and DOCK_VALIDATION_CHUNK_SIZE values. Values that the datasets
+    checked earlier in the run would create, by any lookup field, count as
+    resolved, so a dataset can refer to the ones before it, and to itself.
+
+    Custom _save_{model_name_lower_case} methods of the storage class are not
+    run, so whatever they do to an object is not checked.
+
+    """
+
+    # the rows kept per problem, the count is always complete
+    max_rows = 10
+
+    def __init__(self, lookup_fields=None, direct_relation_types=None):
+
+        self.lookup_fields = lookup_fields or config.DOCK_RELATION_LOOKUP_FIELDS
+        self.direct_relation_types = direct_relation_types or config.DOCK_DIRECT_RELATION_TYPES
+        self.rows = 0
+        self.unknown_headers = []
+        self.type_errors = []
+        self.unresolved = []
+        # (model, lookup) -> set of unicode values created by the datasets checked so far
+        self._created = {}
+
+    @property
+    def valid(self):
+
+        return not (self.unknown_headers or self.type_errors or self.unresolved)
+
+    def check(self, model, dataset):
+        """Check each object of `dataset`, and return the number of objects checked."""
+
+        plan = LoadPlan(model, self.direct_relation_types)
+        label = model._meta.app_label + '.' + model.__name__
+        field_names = set(field.name for field in model._meta.fields)
+        created_lookups = [lookup for lookup in self.lookup_fields if lookup in field_names or lookup == 'pk']
+        unknown = {}
+        type_errors = {}
+        # (related model, lookups) -> {value: [count, rows]}
+        references = OrderedDict()
+        rows = 0
+
+        for row, obj in enumerate(dataset, 1):
+            rows += 1
+
+            for header, value in obj.iteritems():
+                try:
+                    field_name, internal_type, target, header_args = plan.column(header)
+                except (AttributeError, AssertionError) as e:
+                    self._add(unknown, header, row, e)
+                    continue
+
+                if internal_type is None:
+                    try:
+                        target.clean(value, None)
+                    except lazy.ValidationError as e:
+                        self._add(type_errors, (header, value), row, '; '.join(e.messages))
+
+                elif internal_type in ('ManyToManyField', 'ForeignKey', 'OneToOneField'):
+                    # a custom dataset processor may have found the instance already
+                    if isinstance(value, lazy.models.Model):
+                        continue
+
+                    values = unicode(value).split(config.DOCK_FIELD_ARGS_SEPARATOR) \
+                        if internal_type == 'ManyToManyField' else [value]
+                    key = (target.rel.to, tuple(header_args) + tuple(f for f in self.lookup_fields if f not in header_args))
+
+                    for v in values:
+                        self._add(references.setdefault(key, {}), unicode(v), row)
+
+            # what this object would create, for the objects and datasets after it
+            for lookup in created_lookups:
+                value = obj.get('id' if lookup == 'pk' else lookup)
+                if value not in (None, ''):
+                    self._created.setdefault((model, lookup), set()).add(unicode(value))
+
+        for (related_model, lookups), values in references.iteritems():
+            missing = self._resolve(related_model, lookups, values)
+
+            for value in missing:
+                count, kept_rows = values[value][:2]
+                self.unresolved.append({
+                    'model': label,
+                    'related_model': related_model._meta.app_label + '.' + related_model.__name__,
+                    'value': value,
+                    'count': count,
+                    'rows': kept_rows,
+                })
+
+        for header, (count, kept_rows, error) in unknown.iteritems():
+            self.unknown_headers.append({'model': label, 'header': header, 'count': count, 'rows': kept_rows,
+                                         'error': unicode(error)})
+
+        for (header, value), (count, kept_rows, error) in type_errors.iteritems():
+            self.type_errors.append({'model': label, 'header': header, 'value': value, 'count': count,
+                                     'rows': kept_rows, 'error': error})
+
+        self.rows += rows
+        return rows
+
+    def report(self):
+
+        return {
+            'valid': self.valid,
+            'rows': self.rows,
+            'unknown_headers': self.unknown_headers,
+            'type_errors': self.type_errors,
+            'unresolved': self.unresolved,
+        }
+
+    def _add(self, problems, key, row, error=None):
+
+        try:
+            problem = problems[key]
+        except KeyError:
+            problem = problems[key] = [0, [], error]
+
+        problem[0] += 1
+        if len(problem[1]) < self.max_rows:
+            problem[1].append(row)
+
+    def _resolve(self, model, lookups, values):
+        """Returns the values that no instance of `model` can be found for, by any of `lookups`."""
+
+        remaining = set(values)
+
+        for lookup in lookups:
+            if not remaining:
+                break
+
+            remaining -= self._created.get((model, lookup), set())
+
+            try:
+                field = model._meta.pk if lookup == 'pk' else model._meta.get_field(lookup)
+            except lazy.FieldDoesNotExist:
+                continue
+
+            # values the field can't hold can't be found by it, and would break the query
+            converted = {}
+            for value in remaining:
+                try:
+                    converted[field.to_python(value)] = value
+                except lazy.ValidationError:
+                    continue
+
+            keys = list(converted)
+
+            for offset in range(0, len(keys), config.DOCK_VALIDATION_CHUNK_SIZE):
+                chunk = keys[offset:offset + config.DOCK_VALIDATION_CHUNK_SIZE]
+                found = model._default_manager.filter(**{field.name + '__in': chunk}).values_list(field.name,
+                                                                                                flat=True)
+
+                for value in found:
+                    remaining.discard(converted.get(value, unicode(value)))
+
+        return sorted(remaining)
+
+
+class Parser(object):
+
+    """Reads a data source, and returns its clean objects for Process.
+
+    Parsers that return a generator, instead of a list, set `streaming`. Process
+    passes itself to `parse`, so parsers can use its header cleaning.
+
+    """
+
+    streaming = False
+
+    def parse(self, process, model, data_source):
+
+        raise NotImplementedError
+
+
+class TablibParser(Parser):
+
+    """Reads a data source of any format tablib knows, whole."""
+
+    def parse(self, process, model, data_source):
+
+        return process._extract_and_clean(model, data_source)
+
+
+class CSVParser(Parser):
+
+    """Reads a CSV data source row by row, with the csv module."""
+
+    streaming = True
+    delimiter = ','
+
+    def parse(self, process, model, data_source):
+
+        return process._stream_data(data_source, delimiter=self.delimiter)
+
+
+class TSVParser(CSVParser):
+
+    """Reads a tab separated data source row by row, with the csv module."""
+
+    delimiter = '\t'
+
+
+class CSVRangeParser(CSVParser):
+
+    """Reads the rows of a CSV data source between two byte offsets, for a shard of a Process.
+
+    `start` and `end` must be at line boundaries, and `headers` are the clean
+    headers of the data source, which are on its first line only.
+
+    """
+
+    def __init__(self, start, end, headers, delimiter=','):
+
+        self.start = start
+        self.end = end
+        self.headers = headers
+        self.delimiter = delimiter
+
+    def parse(self, process, model, data_source):
+
+        headers = self.headers
+
+        with open(data_source, 'rb') as f:
+            for row in utf8_rows(csv.reader(self._lines(f), delimiter=self.delimiter)):
+                yield dict(compress(zip(headers, row), row))
+
+    def _lines(self, f):
+
+        f.seek(self.start)
+        position = self.start
+
+        # readline, not iteration, so we know where we are
+        while position < self.end:
+            line = f.readline()
+            if not line:
+                return
+
+            position += len(line)
+            yield line
+
+
+class JSONLinesParser(Parser):
+
+    """Reads a data source with one JSON object per line, a line at a time.
+
+    Lists, for many to many fields, are joined with DOCK_FIELD_ARGS_SEPARATOR.
+
+    """
+
+    streaming = True
+
+    def parse(self, process, model, data_source):
+
+        headers = {}
+
+        with process._open_source(data_source) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                obj = {}
+
+                for k, v in json.loads(line).iteritems():
+                    # zeros and false are values, like they are in a CSV file
+                    if v is None or v == '' or v == []:
+                        continue
+
+                    if isinstance(v, list):
+                        v = config.DOCK_FIELD_ARGS_SEPARATOR.join(unicode(value) for value in v)
+
+                    try:
+                        header = headers[k]
+                    except KeyError:
+                        header = headers[k] = process._normalize_header(k)
+
+                    obj[header] = v
+
+                yield obj
+
+
+class XLSXParser(Parser):
+
+    """Reads the first sheet of an Excel workbook row by row, without loading the whole workbook."""
+
+    streaming = True
+
+    def parse(self, process, model, data_source):
+
+        # openpyxl is an extended requirement
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(data_source, read_only=True, data_only=True)
+
+        try:
+            rows = workbook.worksheets[0].iter_rows()
+            headers = None
+
+            for row in rows:
+                values = [cell.value for cell in row]
+
+                if headers is None:
+                    headers = [process._normalize_header(header) for header in values]
+                    continue
+
+                yield dict(compress(zip(headers, values), [v is not None and v != '' for v in values]))
+
+        finally:
+            # read only workbooks keep their file open until closed
+            if hasattr(workbook, 'close'):
+                workbook.close()
+
+
+class PandasParser(Parser):
+
+    """Reads a CSV data source with pandas, `chunk_size` rows at a time.
+
+    Headers are cleaned once per data source, and empty values are dropped for
+    a whole chunk at once, instead of cell by cell.
+
+    """
+
+    streaming = True
+
+    def __init__(self, chunk_size=None):
+
+        self.chunk_size = chunk_size or config.DOCK_PARSER_CHUNK_SIZE
+
+    def parse(self, process, model, data_source):
+
+        # pandas is an extended requirement, and slow to import
+        import pandas
+
+        # read every value as a unicode string, like the other parsers, and only empty ones as missing
+        chunks = pandas.read_csv(data_source, dtype=object, keep_default_na=False, na_values=[''],
+                                 encoding='utf-8', chunksize=self.chunk_size)
+        headers = None
+
+        for chunk in chunks:
+            if headers is None:
+                headers = list(chunk.columns.map(process._normalize_header))
+
+            present = chunk.notnull().values
+
+            if present.all():
+                for values in chunk.values.tolist():
+                    yield dict(zip(headers, values))
+                continue
+
+            for values, mask in zip(chunk.values.tolist(), present.tolist()):
+                yield dict(compress(zip(headers, values), mask))
+
+
+PARSERS = {
+    'tablib': TablibParser,
+    'csv': CSVParser,
+    'tsv': TSVParser,
+    'jsonl': JSONLinesParser,
+    'xlsx': XLSXParser,
+    'pandas': PandasParser,
+}
+
+# the parsers for data sources of each extension, when Process is not told otherwise
+EXTENSION_PARSERS = {
+    '.tsv': 'tsv',
+    '.jsonl': 'jsonl',
+    '.xlsx': 'xlsx',
+}
+
+
+class DatasetProcessor(object):
+
+    """Transforms the objects of a dataset in Process, a batch at a time.
+
+    `process` takes a model and an iterable of batches, which are lists of
+    clean objects of that model, and yields batches. It can change, drop or
+    add objects, and yield batches of any size. By default, it passes each
+    batch through `process_batch`, so a processor that works on one batch at
+    a time only needs to implement that.
+
+    Batches are of DOCK_PROCESSOR_BATCH_SIZE objects. For the models in
+    `whole_models`, the whole dataset comes as a single batch, for processors
+    that need to see all of it, like a validation of the set; only those
+    datasets are held in memory. With `models`, the processor only gets the
+    datasets of those models, and the others go past it untouched.
+
+    Process chains its `processors` in order: each gets the batches the one
+    before it yielded. For example:
+
+        class Uppercase(DatasetProcessor):
+
+            models = (Book,)
+
+            def process_batch(self, model, batch):
+                for obj in batch:
+                    obj['name'] = obj['name'].upper()
+                return batch
+
+        Process(inventory, processors=[Uppercase(), UniqueTitles()])
+
+    """
+
+    # the models this processor is for, or None for all of them
+    models = None
+
+    # the models whose datasets this processor gets whole, as one batch
+    whole_models = ()
+
+    def process(self, model, batches):
+
+        for batch in batches:
+            yield self.process_batch(model, batch)
+
+    def process_batch(self, model, batch):
+
+        return batch
+
+
+class ProcessedItem(tuple):
+
+    """A (model, dataset) tuple of Process.processed, with the data source it was read from as `data_source`.
+
+    It unpacks like any (model, dataset) tuple, so dataset processors that
+    pass items on keep their data source. Items made up by a processor are
+    plain tuples, without one.
+
+    """
+
+    def __new__(cls, model, dataset, data_source=None):
+
+        item = super(ProcessedItem, cls).__new__(cls, (model, dataset))
+        item.data_source = data_source
+        return item
+
+
+class Pipeline(object):
+
+    """Reads the datasets of a Process ahead of the one being saved, in a thread.
+
+    The objects of each dataset are put in a queue of `size` chunks of
+    DOCK_PIPELINE_CHUNK_SIZE objects, in order, and the datasets returned by
+    `processed` take them from there. When the queue is full, reading waits.
+    Datasets are to be saved in order, and a dataset that is not read to its
+    end is skipped. Datasets for which `skip(index, item)` is true are not
+    read at all. An error while reading is raised where the dataset is saved.
+
+    """
+
+    def __init__(self, processed, size, skip=None):
+
+        self.items = list(processed)
+        self.queue = Queue.Queue(maxsize=size)
+        self.chunk_size = config.DOCK_PIPELINE_CHUNK_SIZE
+        self.skip = skip
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def processed(self):
+        """Start reading, and return the processed datasets, as generators that take from the queue."""
+
+        self._thread = threading.Thread(target=self._read, name='dock-pipeline')
+        self._thread.daemon = True
+        self._thread.start()
+
+        pipelined = []
+
+        for index, item in enumerate(self.items):
+            pipelined.append(ProcessedItem(item[0], self._dataset(index), getattr(item, 'data_source', None)))
+
+        return pipelined
+
+    def stop(self):
+
+        self._stopped.set()
+
+        # unblock the reader, if it waits for room in the queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def _put(self, item):
+
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+
+        return False
+
+    def _read(self):
+
+        for index, item in enumerate(self.items):
+            dataset = item[1]
+            chunk = []
+
+            try:
+                if self.skip is not None and self.skip(index, item):
+                    dataset = ()
+
+                for obj in dataset:
+                    chunk.append(obj)
+
+                    if len(chunk) >= self.chunk_size:
+                        if not self._put((index, chunk)):
+                            return
+                        chunk = []
+
+            except Exception as e:
+                self._put((index, e))
+                return
+
+            if chunk and not self._put((index, chunk)):
+                return
+
+            # the end of a dataset
+            if not self._put((index, None)):
+                return
+
+    def _dataset(self, index):
+
+        while True:
+            item_index, chunk = self.queue.get()
+
+            # the rest of a dataset that was not read to its end
+            if item_index < index:
+                continue
+
+            if chunk is None:
+                return
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            for obj in chunk:
+                yield obj
+
+
+class WorkerPool(object):
+
+    """A pool of `size` threads, which call `function` with each task put in the pool.
+
+    `get` waits for a task to be done, and returns a tuple of the task, and
+    the exception it raised and its formatted traceback, or None and None.
+    Each thread has its own connections to the data store, and closes them
+    when the pool is closed.
+
+    """
+
+    def __init__(self, function, size):
+
+        self.function = function
+        self.tasks = Queue.Queue()
+        self.done = Queue.Queue()
+        self.threads = [threading.Thread(target=self._work, name='dock-worker-%s' % n) for n in range(size)]
+
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def put(self, task):
+
+        self.tasks.put(task)
+
+    def get(self):
+
+        return self.done.get()
+
+    def close(self):
+        """Wait for the tasks that were put in the pool, and stop its threads."""
+
+        for thread in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self):
+
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break
+
+                try:
+                    self.function(task)
+                    self.done.put((task, None, None))
+                except Exception as e:
+                    self.done.put((task, e, traceback.format_exc()))
+
+        finally:
+            for connection in lazy.connections.all():
+                connection.close()
+
+
+class ShardError(Exception):
+
+    """Raised by Process when shards of a data source failed, with the traceback of each in `errors`."""
+
+    def __init__(self, data_source, errors):
+
+        super(ShardError, self).__init__('%s of the shards of %s failed:\n%s'
+                                         % (len(errors), data_source, '\n'.join(errors)))
+        self.data_source = data_source
+        self.errors = errors
+
+
+class SaveError(Exception):
+
+    """Raised by Process when datasets saved concurrently failed, with the model and traceback of each in `errors`."""
+
+    def __init__(self, errors):
+
+        super(SaveError, self).__init__('%s of the datasets failed to save:\n%s' % (len(errors), '\n'.join(errors)))
+        self.errors = errors
+
+
+class Process(object):
+
+    """Takes data, as list of tuples, validates, and saves to the data store.
+
+    Each tuple passed in the list has the following signature:
+
+    (model, data_source)
+
+    Where:
+
+    * *module* describes a python module in the project that holds *model*
+    * *data_source* is the file with data for *model*, or a file-like object
+
+    Data sources are read by a parser, see Parser. `parser` is the name of a
+    parser in PARSERS, a Parser class or instance, or a dict of those by file
+    extension. The data sources with an extension in EXTENSION_PARSERS are
+    streamed by their parser, unless a dict names another for that extension;
+    a parser that is not in a dict reads the others, which are read with
+    TablibParser by default. With `stream=True`, the default for those is
+    CSVParser: data sources are read as CSV, row by row, and each dataset is a
+    generator of clean objects instead of a list, so memory use does not grow
+    with the size of the data sources.
+
+    With `coerce=True`, the values of fields with an internal type in
+    DOCK_COERCED_FIELD_TYPES are converted to their python type, a column at a
+    time, before the objects reach the storage class. A dry run does not
+    coerce, so Validation reports every value that would not convert.
+
+    Related instances are looked up through a LookupCache of `lookup_cache_size`
+    entries, which is kept on the instance as `lookup_cache` when the run is
+    over, for its hit and miss counts. Pass `lookup_cache_size=0` to query the
+    data store for every lookup, and `prefetch=True` to load each related model
+    whole on its first lookup.
+
+    With `workers` greater than 1, datasets that do not depend on each other
+    are saved concurrently, by that many threads. Dependencies are taken from
+    `dependencies`, as returned by Unload.dependency_graph, or else worked out
+    from the processed datasets with `dependency_graph`. When a dataset fails,
+    the datasets already being saved are finished, no others are started, and
+    a SaveError is raised with the error of each that failed. The time it took
+    to save each dataset is kept on the instance as `timings`.
+
+    With a `manifest`, as made by Unload, each data source that was saved
+    successfully is recorded in the manifest, so it can be skipped on the
+    next run if it did not change.
+
+    Pass `stats=True`, or a LoadStats, to record where the time of the run goes.
+    The LoadStats is kept on the instance as `stats`.
+
+    With `commit_every`, the objects of each dataset are saved in transactions
+    of that many objects, instead of one transaction per query. The time each
+    commit took is kept on the instance as `commits`. With a `checkpoint_file`
+    too, progress is recorded there after each commit: if the run is interrupted,
+    the next run with the same inventory and checkpoint file skips what was
+    already committed.
+
+    With a `cache_dir`, each clean dataset is kept there in a DatasetCache, by
+    the content hash of its data source, and read back from the cache instead
+    of parsing the data source again when it did not change. Streamed datasets
+    are not cached.
+
+    Instances created during the run are kept in an IdentityMap, on the
+    instance as `identity_map`, so references to objects loaded earlier in the
+    run are resolved without a query. It keeps DOCK_IDENTITY_MAP_SIZE entries
+    at most; pass `identity_map=False` to not keep any. References of a
+    model to itself that point further down its data source are deferred, and
+    set once the dataset is saved, with one query per DOCK_BULK_UPDATE_SIZE
+    objects, and one insert per many to many field. A
+    checkpoint does not record deferred references, so those of an interrupted
+    run are lost when it resumes.
+
+    With `shards` greater than 1, each CSV or TSV data source is split into
+    that many ranges of lines, which are saved concurrently by a pool of as
+    many processes, each with its own connections to the data store and its
+    own Process, and nothing else reads it. This is for datasets with no line
+    breaks inside quoted values. The rows and seconds of each shard are kept
+    on the instance as `shard_results`, and the stats of the shards are added
+    to `stats`. When shards fail, the others still run, and a ShardError is
+    raised at the end, with the error of each. Data sources
+    that are file-like objects, smaller than DOCK_SHARD_MIN_SIZE, of models
+    with relation fields, coerced, processed by dataset processors, loaded
+    with a `checkpoint_file`, or saved through another adapter than
+    DjangoAdapter are not sharded. The shards commit on their own, so an
+    interrupted run could not be resumed without saving their rows twice.
+
+    Datasets can be transformed on their way to the data store by a chain of
+    `processors`, see DatasetProcessor, which work on batches of objects, so
+    only the datasets a processor asks to see whole are held in memory. The
+    older `dataset_processing_class` is still supported: its `processed` gets
+    the list of (model, dataset) tuples, after the processors, and returns it.
+    The tuples are ProcessedItem, which carry their data source; datasets in
+    tuples it makes up are not recorded in the checkpoint or the manifest.
+
+    With `pipeline=True`, or the number of chunks to read ahead, data sources
+    are read and cleaned by a Pipeline in a thread of their own, while the
+    dataset before them is saved. Datasets are then only read when the
+    pipeline gets to them, in chunks of DOCK_PIPELINE_CHUNK_SIZE objects,
+    and reading stops while the chunks ahead of the one being saved are as
+    many as the pipeline allows, so memory use stays bounded. With `workers`
+    greater than 1, there is no pipeline, as datasets overlap already.
+
+    Objects are written by a StorageAdapter, `adapter`, which is a
+    DjangoAdapter by default. With a DBAPIAdapter, rows are inserted straight
+    into the tables of plain models, without the storage class.
+
+    With `dry_run=True`, nothing is written: every dataset is checked by a
+    Validation instead, which is kept on the instance as `validation`, with all
+    the unknown headers, type errors and unresolved relations found.
+
+    """
+
+    def __init__(self, inventory, storage_class=Store, dataset_processing_class=None, batch_size=None,
+                 stream=False, lookup_cache_size=None, prefetch=False, workers=1, dependencies=None,
+                 manifest=None, stats=None, commit_every=None, checkpoint_file=None, cache_dir=None,
+                 parser=None, coerce=False, dry_run=False, identity_map=True, adapter=None, shards=None,
+                 pipeline=False, processors=None):
+
+        if not isinstance(inventory, (list, tuple)):
+            raise AssertionError("Store requires inventory as a list or a tuple, you passed neither.")
+
+        # processors can be given as classes, like parsers
+        processors = [processor() if isinstance(processor, type) else processor for processor in processors or ()]
+
+        for processor in processors:
+            if not callable(getattr(processor, 'process', None)):
+                raise AssertionError("Dataset processors must have a callable attribute named `process`, "
+                                     "see DatasetProcessor")
+
+        if dataset_processing_class:
+            if not isinstance(dataset_processing_class, type):
+                raise AssertionError("Dataset Processor must be a class")
+
+            if not hasattr(dataset_processing_class, 'processed'):
+                raise AssertionError("Dataset Processor must have a callable attribute named `processed`")
+
+        self.inventory = inventory
+        self.storage_class = storage_class
+
+        # only used by bulk storage classes, like BulkStore
+        self.batch_size = batch_size
+        self.stream = stream
+        self.parser = parser
+        self.coerce = coerce
+
+        if lookup_cache_size == 0:
+            self.lookup_cache = None
+        else:
+            self.lookup_cache = LookupCache(max_size=lookup_cache_size, prefetch=prefetch)
+
+        self.workers = workers
+        self.dependencies = dependencies
+        self.timings = []
+        self.manifest = manifest
+        self.stats = LoadStats() if stats is True else stats
+        self.commit_every = commit_every
+        self.checkpoint = Checkpoint(checkpoint_file) if checkpoint_file else None
+        self.commits = []
+        self.dataset_cache = DatasetCache(cache_dir) if cache_dir else None
+        self.dry_run = dry_run
+        self.validation = None
+        self.identity_map = IdentityMap() if identity_map else None
+        self.adapter = adapter or DjangoAdapter()
+        self.shards = shards
+        self.shard_results = []
+        self.pipeline = config.DOCK_PIPELINE_QUEUE_SIZE if pipeline is True else pipeline
+
+        # `self.dataset_processing_class` is implemented to allow processing of the dataset as a whole,
+        # for example, validations on the whole set, extracting additional datasets
+        # out of the passed dataset, and so on.
+        self.dataset_processing_class = dataset_processing_class
+        self.processors = processors
+        self.save()
+
+    def processed(self):
+        """Extract data from the source files, clean headers and rows, and return a list of ProcessedItem tuples."""
+
+        processed = []
+
+        for item in self.inventory:
+            model, data_source = item
+
+            # in a pipeline, a dataset processor still gets the datasets read, like always,
+            # and a data source that is sharded is read by the shards
+            if (self.pipeline and not self.dataset_processing_class) or \
+                    self._shard_delimiter(model, data_source) is not None:
+                dataset_clean = self._lazy_dataset(model, data_source)
+            else:
+                dataset_clean = self._dataset(model, data_source)
+
+            if self.processors:
+                dataset_clean = self._process_batches(model, dataset_clean)
+
+            processed.append(ProcessedItem(model, dataset_clean, data_source))
+
+        if self.dataset_processing_class:
+            # We'll send processed as the first argument of whatever class we are given
+            # We expect that class to implement a processed method that returns an ordered
+            # list of (model, dataset) tuples, just list Process.processed
+            dataset_processor = self.dataset_processing_class(processed)
+            processed = dataset_processor.processed()
+
+        return processed
+
+    def _dataset(self, model, data_source):
+        """Returns the clean dataset of `data_source`."""
+
+        parser = self._parser_for(data_source)
+
+        if parser.streaming:
+            # nothing is read until the dataset is iterated over
+            dataset_clean = parser.parse(self, model, data_source)
+            if self.stats is not None:
+                dataset_clean = self._timed_rows(model, dataset_clean)
+
+        elif self.dataset_cache is not None and not hasattr(data_source, 'read'):
+            key = self.dataset_cache.key(data_source)
+
+            if self.stats is not None:
+                start = time.time()
+
+            dataset_clean = self.dataset_cache.get(key)
+
+            if dataset_clean is None:
+                dataset_clean = parser.parse(self, model, data_source)
+                self.dataset_cache.set(key, dataset_clean)
+
+            elif self.stats is not None:
+                self.stats.add(model, 'extract', time.time() - start)
+
+        else:
+            dataset_clean = parser.parse(self, model, data_source)
+
+        # a dry run reports the values that don't convert, instead of stopping at the first one
+        if self.coerce and not self.dry_run:
+            dataset_clean = self._coerce(model, dataset_clean)
+
+        return dataset_clean
+
+    def _process_batches(self, model, dataset):
+        """Yield the objects of `dataset`, once they went through the processors, a batch at a time."""
+
+        objs = iter(dataset)
+        batches = iter(lambda: list(islice(objs, config.DOCK_PROCESSOR_BATCH_SIZE)), [])
+
+        for processor in self.processors:
+            # any object with a `process` will do, it does not have to be a DatasetProcessor
+            models = getattr(processor, 'models', None)
+            if models is not None and model not in models:
+                continue
+
+            if model in getattr(processor, 'whole_models', ()):
+                batches = self._whole(batches)
+
+            batches = processor.process(model, batches)
+
+        for batch in batches:
+            for obj in batch:
+                yield obj
+
+    def _whole(self, batches):
+
+        yield [obj for batch in batches for obj in batch]
+
+    def _lazy_dataset(self, model, data_source):
+        """Yield the clean objects of `data_source`, which is only read once they are asked for."""
+
+        for obj in self._dataset(model, data_source):
+            yield obj
+
+    def _parser_for(self, data_source):
+        """Returns the parser instance to read `data_source` with."""
+
+        parser = self.parser
+        ext = None if hasattr(data_source, 'read') else os.path.splitext(data_source)[1]
+
+        if isinstance(parser, dict):
+            parser = parser.get(ext)
+
+        # a parser for the whole run is for CSV, the other formats have theirs
+        elif ext in EXTENSION_PARSERS:
+            parser = None
+
+        if parser is None:
+            parser = EXTENSION_PARSERS.get(ext) or ('csv' if self.stream else 'tablib')
+
+        if isinstance(parser, basestring):
+            parser = PARSERS[parser]
+
+        if isinstance(parser, type):
+            parser = parser()
+
+        return parser
+
+    def _extract_and_clean(self, model, data_source):
+
+        if self.stats is None:
+            return self._clean_data(self._extract_data(data_source))
+
+        start = time.time()
+        dataset_raw = self._extract_data(data_source)
+        self.stats.add(model, 'extract', time.time() - start)
+
+        start = time.time()
+        dataset_clean = self._clean_data(dataset_raw)
+        self.stats.add(model, 'clean', time.time() - start)
+
+        return dataset_clean
+
+    def save(self):
+        """Unpack our processed data and pass each object to storage class for saving."""
+
+        processed = self.processed()
+
+        if self.dry_run:
+            return self._validate(processed)
+
+        pipeline = None
+
+        try:
+            if self.workers > 1:
+                self._save_concurrently(processed)
+
+            else:
+                if self.pipeline:
+                    pipeline = Pipeline(processed, self.pipeline, skip=self._skip_reading)
+                    processed = pipeline.processed()
+
+                for index, item in enumerate(processed):
+                    model, dataset = item
+                    self._save_dataset(model, dataset, index, getattr(item, 'data_source', None))
+
+            # done, there is nothing left to resume
+            if self.checkpoint is not None:
+                self.checkpoint.clear()
+
+        finally:
+            if pipeline is not None:
+                pipeline.stop()
+
+            if self.manifest is not None:
+                self.manifest.compact()
+
+            if self.stats is not None:
+                self.stats.finish()
+
+    def _validate(self, processed):
+        """Check the processed datasets, in order, without writing anything."""
+
+        self.validation = Validation()
+
+        try:
+            for model, dataset in processed:
+                if self.stats is None:
+                    self.validation.check(model, dataset)
+                    continue
+
+                start = time.time()
+                rows = self.validation.check(model, dataset)
+                self.stats.add(model, 'validate', time.time() - start)
+                self.stats.add_rows(model, rows)
+
+        finally:
+            if self.stats is not None:
+                self.stats.finish()
+
+    def _skip_reading(self, index, item):
+        """Returns True for datasets that _save_dataset would not read, sharded or already saved."""
+
+        data_source = getattr(item, 'data_source', None)
+
+        if self.checkpoint is not None and self.checkpoint.get(index, data_source) is True:
+            return True
+
+        return self._shard_delimiter(item[0], data_source) is not None
+
+    def _save_dataset(self, model, dataset, index=None, data_source=None):
+
+        start = time.time()
+
+        stats = self.stats
+        rows = 0
+
+        if self.checkpoint is not None:
+            rows = self.checkpoint.get(index, data_source)
+
+            # saved by an earlier, interrupted run
+            if rows is True:
+                return
+
+            if rows:
+                dataset = islice(dataset, rows, None)
+
+        # what we know about this model is about to be out of date
+        if self.lookup_cache is not None:
+            self.lookup_cache.invalidate(model)
+
+        if stats is not None:
+            stats.begin(model)
+
+        deferred = []
+
+        delimiter = self._shard_delimiter(model, data_source)
+
+        if delimiter is not None:
+            rows = self._save_sharded(model, data_source, delimiter)
+
+        elif self.commit_every:
+            objs = iter(dataset)
+
+            while True:
+                batch = list(islice(objs, self.commit_every))
+                if not batch:
+                    break
+
+                self._save_transaction(model, batch, deferred)
+                rows += len(batch)
+
+                if self.checkpoint is not None:
+                    self.checkpoint.update(index, data_source, rows)
+
+        else:
+            rows += self._save_objs(model, dataset, deferred)
+
+        if deferred:
+            with lazy.transaction.atomic(using=lazy.router.db_for_write(model)):
+                self._save_deferred(model, deferred)
+
+        if self.checkpoint is not None:
+            self.checkpoint.update(index, data_source, True)
+
+        # datasets that a dataset processor made up have no data source we can record
+        if self.manifest is not None and data_source is not None and not hasattr(data_source, 'read'):
+            self.manifest.update(data_source, rows)
+
+        self.timings.append({
+            'model': model._meta.app_label + '.' + model.__name__,
+            'rows': rows,
+            'seconds': time.time() - start,
+            'worker': threading.current_thread().name,
+        })
+
+    def _shard_delimiter(self, model, data_source):
+        """Returns the delimiter of `data_source` if it is to be sharded, or None."""
+
+        if not (self.shards and self.shards > 1 and data_source is not None and
+                not hasattr(data_source, 'read') and not self.coerce and
+                self.dataset_processing_class is None and not self.processors and
+                self.checkpoint is None and isinstance(self.adapter, DjangoAdapter)):
+            return None
+
+        # the rows of a shard can't refer to the rows of another
+        if any(field.rel for field in list(model._meta.fields) + list(model._meta.many_to_many)):
+            return None
+
+        if os.path.getsize(data_source) < config.DOCK_SHARD_MIN_SIZE:
+            return None
+
+        parser = self._parser_for(data_source)
+
+        if isinstance(parser, CSVParser):
+            return parser.delimiter
+
+        # tablib reads CSV whole, but the data source is CSV all the same
+        if isinstance(parser, TablibParser) and os.path.splitext(data_source)[1] == '.csv':
+            return ','
+
+    def _save_sharded(self, model, data_source, delimiter):
+        """Save a data source with a pool of processes, a range of its lines each, and return the rows saved."""
+
+        header_end, ranges = line_ranges(data_source, self.shards)
+
+        with open(data_source, 'rb') as f:
+            headers = [self._normalize_header(header)
+                       for header in next(utf8_rows(csv.reader([f.readline()], delimiter=delimiter)))]
+
+        options = {
+            'storage_class': self.storage_class,
+            'batch_size': self.batch_size,
+            'lookup_cache_size': 0 if self.lookup_cache is None else self.lookup_cache.max_size,
+            'prefetch': self.lookup_cache is not None and self.lookup_cache.prefetch,
+            # the models of shards have no relations, so there is nothing to look up by the pks read back
+            'identity_map': False,
+            'stats': True if self.stats is not None else None,
+            'commit_every': self.commit_every,
+        }
+        # by extension, so it reads TSV data sources too
+        ext = os.path.splitext(data_source)[1]
+        tasks = [(model, data_source, {ext: CSVRangeParser(start, end, headers, delimiter)}, options)
+                 for start, end in ranges]
+
+        # the processes must not share the connections of this one
+        for connection in lazy.connections.all():
+            connection.close()
+
+        pool = lazy.multiprocessing.Pool(min(self.shards, len(tasks)))
+
+        try:
+            results = pool.map(_load_shard, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        errors = []
+        rows = 0
+
+        for (start, end), result in zip(ranges, results):
+            self.shard_results.append({
+                'model': model._meta.app_label + '.' + model.__name__,
+                'start': start,
+                'end': end,
+                'rows': result['rows'],
+                'seconds': result['seconds'],
+                'error': result['error'],
+            })
+            rows += result['rows']
+
+            if result['error']:
+                errors.append(result['error'])
+
+            if self.stats is not None and result['stats']:
+                self.stats.merge(model, result['stats'])
+
+        if errors:
+            raise ShardError(data_source, errors)
+
+        return rows
+
+    def _save_objs(self, model, objs, deferred=None):
+        """Pass the objects to the storage adapter for saving, and return how many there were."""
+
+        rows = self.adapter.save(self, model, objs, deferred)
+
+        if self.stats is not None:
+            self.stats.add_rows(model, rows)
+
+        return rows
+
+    def _save_transaction(self, model, objs, deferred=None):
+        """Save the objects in one transaction, and record how long the commit took."""
+
+        with lazy.transaction.atomic(using=lazy.router.db_for_write(model)):
+            rows = self._save_objs(model, objs, deferred)
+            # the commit happens as the block exits
+            start = time.time()
+
+        seconds = time.time() - start
+
+        self.commits.append({
+            'model': model._meta.app_label + '.' + model.__name__,
+            'rows': rows,
+            'seconds': seconds,
+        })
+
+        if self.stats is not None:
+            self.stats.add(model, 'commit', seconds)
+
+    def _save_deferred(self, model, deferred):
+        """Set the references that were deferred while saving a dataset, now that all its objects exist."""
+
+        stats = self.stats
+
+        # misses for these values were cached while the dataset was being saved
+        if self.lookup_cache is not None:
+            self.lookup_cache.invalidate(model)
+
+        store = BulkStore(model, (), lookup_cache=self.lookup_cache, stats=stats, identity_map=self.identity_map)
+        updates = OrderedDict()
+        related = OrderedDict()
+
+        for instance, field, value, header_args in deferred:
+            # still missing now, it was never going to be there
+            found = store._find_instance(model, value, extra_lookups=header_args)
+
+            if field.get_internal_type() == 'ManyToManyField':
+                related.setdefault(instance, OrderedDict()).setdefault(field, []).append(found)
+            else:
+                updates.setdefault(field, OrderedDict())[instance.pk] = found.pk
+
+        if stats is not None:
+            start = time.time()
+
+        store._save_updates(updates)
+        store._save_related([(instance, [(field, 'ManyToManyField', values) for field, values in fields.iteritems()])
+                             for instance, fields in related.iteritems()])
+
+        if stats is not None:
+            stats.add(model, 'save', time.time() - start)
+
+    def _save_concurrently(self, processed):
+        """Save the processed datasets with a pool of threads, each dataset once all it depends on is saved."""
+
+        if self.dependencies is not None:
+            dependencies = [set(d) for d in self.dependencies]
+        else:
+            dependencies = dependency_graph(processed)
+
+        if len(dependencies) != len(processed):
+            raise AssertionError("Process dependencies must have an entry for each processed dataset.")
+
+        dependents = [[] for item in processed]
+        for index, depends_on in enumerate(dependencies):
+            for other in depends_on:
+                dependents[other].append(index)
+
+        def save(index):
+            item = processed[index]
+            self._save_dataset(item[0], item[1], index, getattr(item, 'data_source', None))
+
+        pool = WorkerPool(save, min(self.workers, len(processed)))
+        running = 0
+        errors = []
+
+        try:
+            for index, depends_on in enumerate(dependencies):
+                if not depends_on:
+                    pool.put(index)
+                    running += 1
+
+            while running:
+                index, e, tb = pool.get()
+                running -= 1
+
+                if e is not None:
+                    # let the running datasets finish, but don't start any more
+                    model = processed[index][0]
+                    errors.append('%s.%s: %s' % (model._meta.app_label, model.__name__, tb))
+                    continue
+
+                if not errors:
+                    for dependent in dependents[index]:
+                        dependencies[dependent].discard(index)
+                        if not dependencies[dependent]:
+                            pool.put(dependent)
+                            running += 1
+
+        finally:
+            pool.close()
+
+        if errors:
+            raise SaveError(errors)
+
+    def _timed_rows(self, model, dataset):
+        """Yield from a streamed dataset, recording the time it takes as extraction, once it is read or closed."""
+
+        rows = iter(dataset)
+        seconds = 0
+
+        # added up here, so the stats lock and the callbacks are not paid per row
+        try:
+            while True:
+                start = time.time()
+                try:
+                    obj = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.time() - start
+
+                yield obj
+
+        finally:
+            self.stats.add(model, 'extract', seconds)
+
+    @contextmanager
+    def _open_source(self, data_source):
+        """Open a data source path, or use a data source that is already a file-like object."""
+
+        if hasattr(data_source, 'read'):
+            yield data_source
+
+        else:
+            with open(data_source) as f:
+                yield f
+
+    def _extract_data(self, data_source):
+        """Create a Dataset object from the data source."""
+
+        with self._open_source(data_source) as f:
+            stream = f.read()
+            raw_dataset = lazy.tablib.import_set(stream)
+
+        return raw_dataset
+
+    def _stream_data(self, data_source, delimiter=','):
+        """Read a CSV data source row by row, and yield clean objects."""
+
+        with self._open_source(data_source) as f:
+            reader = utf8_rows(csv.reader(f, delimiter=delimiter))
+
+            try:
+                headers = [self._normalize_header(header) for header in next(reader)]
+            except StopIteration:
+                return
+
+            for row in reader:
+                # the values are their own selectors: empty ones are dropped
+                yield dict(compress(zip(headers, row), row))
+
+    def _clean_data(self, raw_dataset):
+        """Takes the raw Dataset and cleans it up."""
+
+        dataset_clean_headers = self._normalize_headers(raw_dataset)
+        dataset_clean = self._normalize_rows(dataset_clean_headers)
+
+        return dataset_clean
+
+    def _normalize_headers(self, dataset):
+        """Clean up the headers of each Dataset."""
+
+        for index, header in enumerate(dataset.headers):
+            dataset.headers[index] = self._normalize_header(header)
+
+        return dataset
+
+    def _normalize_header(self, header):
+        """Clean up a single header."""
+
+        symbols = {
+            # Note: We are now allowing the "_" symbol which is valid in python vars.
+            ord('-'): None,
+            ord('"'): None,
+            ord(' '): None,
+            ord("'"): None,
+        }
+
+        return unicode(header).translate(symbols).lower()
+
+    def _normalize_rows(self, dataset):
+        """Clean up each object in the Dataset."""
+
+        headers = dataset.headers
+
+        # the values are their own selectors: empty ones are dropped
+        return [dict(compress(zip(headers, row), row)) for row in dataset]
+
+    def _coerce(self, model, dataset):
+        """Convert the values of the dataset to the types of their model fields, a column at a time."""
+
+        plan = self.storage_class._plans.get(model)
+        if plan is None:
+            plan = self.storage_class._plans[model] = LoadPlan(model, config.DOCK_DIRECT_RELATION_TYPES)
+
+        if isinstance(dataset, list):
+            return self._coerce_chunk(plan, dataset)
+
+        return self._coerce_chunks(plan, dataset)
+
+    def _coerce_chunks(self, plan, dataset):
+
+        objs = iter(dataset)
+
+        while True:
+            chunk = list(islice(objs, config.DOCK_PARSER_CHUNK_SIZE))
+            if not chunk:
+                return
+
+            for obj in self._coerce_chunk(plan, chunk):
+                yield obj
+
+    def _coerce_chunk(self, plan, chunk):
+
+        for header in set().union(*chunk):
+            coerce = plan.coercer(header)
+            if coerce is None:
+                continue
+
+            for obj in chunk:
+                if header in obj:
+                    obj[header] = coerce(obj[header])
+
+        return chunk
+
+
+def write_atomic(path, content):
+    """Replace the file at `path` with `content`, so that it is never left half written."""
+
+    tmp = path + '.tmp'
+
+    with open(tmp, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.rename(tmp, path)
+
+
+# the models found by get_model, by (app_label, model_name)
+_models = {}
+
+
+def get_model(app_label, model_name):
+    """Returns the model for `app_label` and `model_name`, from Django the first time, and from memory after."""
+
+    try:
+        return _models[(app_label, model_name)]
+    except KeyError:
+        pass
+
+    model = lazy.django_get_model(app_label, model_name)
+
+    # Django raises LookupError for models it does not know, or returns None before 1.7,
+    # and either way they may yet be registered
+    if model is not None:
+        _models[(app_label, model_name)] = model
+
+    return model
+
+
+def utf8_rows(reader):
+    """Decode the rows of a csv reader from UTF-8, which the csv module leaves to us."""
+
+    for row in reader:
+        yield [value.decode('utf-8') for value in row]
+
+
+def line_ranges(path, count):
+    """Split a file with a header line into at most `count` byte ranges, at line boundaries.
+
+    Returns the offset where the header line ends, and a list of (start, end)
+    offsets of similar sizes, that cover the rest of the file.
+
+    """
+
+    size = os.path.getsize(path)
+    boundaries = []
+
+    with open(path, 'rb') as f:
+        f.readline()
+        header_end = f.tell()
+        step = (size - header_end) // count
+
+        for n in range(1, count):
+            f.seek(header_end + n * step)
+            # wherever we land, the range starts after the end of that line
+            f.readline()
+            boundaries.append(f.tell())
+
+    offsets = [header_end] + boundaries + [size]
+    ranges = [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+    return header_end, ranges
+
+
+def _load_shard(task):
+    """Save a range of a data source with a Process of its own, in a process of a pool."""
+
+    model, data_source, parser, options = task
+    start = time.time()
+    error = None
+    process = None
+
+    try:
+        process = Process([(model, data_source)], parser=parser, **options)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        for connection in lazy.connections.all():
+            connection.close()
+
+    rows = 0
+    stats = None
+
+    if process is not None:
+        rows = sum(timing['rows'] for timing in process.timings)
+
+        if process.stats is not None and process.stats.models:
+            stats = list(process.stats.models.values())[0]
+
+    return {
+        'rows': rows,
+        'seconds': time.time() - start,
+        'error': error,
+        'stats': stats,
+    }
+
+
+def file_hash(path):
+    """Returns the hex digest of the content of the file at `path`."""
+
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class Checkpoint(object):
+
+    """Records how far a Process run got, so an interrupted run can carry on from there.
+
+    For each dataset, by the path of its data source (or by its position in
+    the processed datasets, when it has no path), the checkpoint has either
+    the number of rows that were committed, or True once the whole dataset
+    is saved. Keying on the path keeps entries valid when the resumed run
+    skips data sources the interrupted one did not. The file is rewritten atomically
+    after each commit, and removed when the run is over.
+
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, index, data_source):
+        """Returns the rows already committed for the dataset, or True if it is saved."""
+
+        return self.entries.get(self._key(index, data_source), 0)
+
+    def update(self, index, data_source, rows):
+
+        with self._lock:
+            self.entries[self._key(index, data_source)] = rows
+            write_atomic(self.path, json.dumps(self.entries, separators=(',', ':')))
+
+    def clear(self):
+
+        with self._lock:
+            self.entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _key(self, index, data_source):
+
+        if data_source is None or hasattr(data_source, 'read'):
+            return unicode(index)
+
+        return unicode(data_source)
+
+
+class DatasetCache(object):
+
+    """Keeps clean datasets in a compact binary form, to skip parsing data sources that did not change.
+
+    Each dataset is stored by column: the headers, then one list of values per
+    header, with None where an object has no value. The columns are serialized
+    with marshal, in one file per dataset named after the content hash of its
+    data source and the Python and marshal versions, as marshal data is only
+    readable by the version that wrote it.
+
+    """
+
+    # bump when the way data sources are cleaned changes, to leave old entries behind
+    version = 1
+
+    def __init__(self, path):
+
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def key(self, data_source):
+
+        return '%s-%s-py%s%s-%s' % (file_hash(data_source), self.version, sys.version_info[0], sys.version_info[1],
+                                    marshal.version)
+
+    def get(self, key):
+        """Returns the clean dataset stored under `key`, or None."""
+
+        path = os.path.join(self.path, key)
+
+        try:
+            f = open(path, 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.misses += 1
+            return None
+
+        with f:
+            try:
+                headers, columns = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                # empty, or cut short
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        return [dict((k, v) for k, v in zip(headers, values) if v is not None) for values in zip(*columns)]
+
+    def set(self, key, dataset):
+
+        headers = []
+        seen = set()
+
+        for obj in dataset:
+            for k in obj:
+                if k not in seen:
+                    seen.add(k)
+                    headers.append(k)
+
+        columns = [[obj.get(header) for obj in dataset] for header in headers]
+        write_atomic(os.path.join(self.path, key), marshal.dumps((headers, columns), 2))
+
+
+class Manifest(object):
+
+    """Records the data sources that were loaded, to skip those that did not change since.
+
+    Each entry has the size, modification time, content hash and row count of a
+    data source, by its path relative to the manifest. A data source is unchanged
+    if its size and modification time are the same, or else if its content hash is.
+
+    Entries are appended to the manifest file one line at a time, as soon as their
+    data source is saved, so the manifest is never ahead of the data store.
+    `compact` rewrites the file with one line per data source, atomically.
+
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                for line in f:
+                    # a line that was cut short by an interruption is just ignored
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry[0]] = entry[1:]
+
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def unchanged(self, data_source):
+
+        entry = self.entries.get(self._key(data_source))
+        if entry is None:
+            return False
+
+        size, mtime, content_hash, rows = entry
+        stat = os.stat(data_source)
+
+        if stat.st_size != size:
+            return False
+
+        return stat.st_mtime == mtime or file_hash(data_source) == content_hash
+
+    def update(self, data_source, rows):
+
+        stat = os.stat(data_source)
+        key = self._key(data_source)
+        entry = [stat.st_size, stat.st_mtime, file_hash(data_source), rows]
+        line = json.dumps([key] + entry, separators=(',', ':')) + '\n'
+
+        with self._lock:
+            self.entries[key] = entry
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def compact(self):
+
+        with self._lock:
+            write_atomic(self.path, ''.join(json.dumps([key] + self.entries[key], separators=(',', ':')) + '\n'
+                                            for key in sorted(self.entries)))
+
+    def _key(self, data_source):
+
+        return os.path.relpath(os.path.abspath(data_source), self.root)
+
+
+def dependency_graph(inventory):
+    """Takes an ordered list of (model, data_source) tuples, and returns what each entry has to wait for.
+
+    The returned list has a set for each entry of the inventory, with the
+    indexes of the earlier entries that must be saved before it. An entry
+    depends on an earlier one if both are for the same model, or if their
+    models are related by a foreign key or a many to many field, in either
+    direction. Entries for unrelated models can be saved in any order.
+
+    """
+
+    def related_models(model):
+        fields = model._meta.fields + model._meta.many_to_many
+        return set(field.rel.to for field in fields if field.rel)
+
+    relations = {}
+    for model, data_source in inventory:
+        if model not in relations:
+            relations[model] = related_models(model)
+
+    graph = []
+
+    for index, (model, data_source) in enumerate(inventory):
+        depends_on = set()
+
+        for other_index, (other, other_source) in enumerate(inventory[:index]):
+            if other is model or other in relations[model] or model in relations[other]:
+                depends_on.add(other_index)
+
+        graph.append(depends_on)
+
+    return graph
+
+
+class Unload(object):
+
+    """Extracts a full dataset from a path, and sorts the data for further processing.
+
+    Unload walks the dataset directories, top down, from a root directory.
+
+    Using the index files, which declare the *order* that the data should
+    eventually be loaded, and file + directory naming conventions, which
+    declare the modules and models that the data is intended for, we
+    return a list of tuples, where each tuple has the target Model, and the
+    path to the data for that model.
+
+    This list is returned by the `freight` method, and is intended to be consumed
+    by the Process class, which further processed the data and prepares it for
+    saving to the data store.
+
+    Data sources can be in any of `supported_extensions`. When a model has data
+    sources in more than one, the extension that comes first in
+    `supported_extensions` is used, and the others are listed in `ignored`.
+
+    With `manifest_file`, a Manifest is kept next to the root index file, and
+    data sources that did not change since they were last loaded are left out
+    of the inventory. Pass `unload.manifest` to Process to keep it up to date.
+
+    Models are found by `adapter`, a StorageAdapter, which is a DjangoAdapter
+    by default.
+
+    """
+
+    def __init__(self, data_root, ignore_dirs=('assets',), index_file='index.json',
+                 supported_extensions=('.csv', '.tsv', '.jsonl', '.xlsx'), manifest_file=None, adapter=None):
+
+        self.data_root = data_root
+        self.adapter = adapter or DjangoAdapter()
+        self.ignore_dirs = set(ignore_dirs)
+        self.index_file = index_file
+        self.supported_extensions = supported_extensions
+        self.root_index = os.path.abspath(os.path.join(self.data_root, index_file))
+        self.manifest = None
+        self.skipped = []
+        self.ignored = []
+        self._sources = None
+        self._inventory = None
+
+        if manifest_file:
+            self.manifest = Manifest(os.path.join(os.path.dirname(self.root_index), manifest_file))
+
+    def extract_sources(self, refresh=False):
+        """Returns a list of data sources, ordered by desired save order.
+
+        The dataset tree is walked once, from the root index file down through the
+        directories each index orders, and the result is kept for later calls.
+        Pass `refresh=True` to walk it again.
+
+        """
+
+        if self._sources is None or refresh:
+            self._sources = []
+            self.ignored = []
+            self._inventory = None
+            self._extract_branch(self.data_root, self._sources)
+
+        return list(self._sources)
+
+    def _extract_branch(self, branch, sources):
+        """Append the data sources of `branch`, and of the branches it orders, to `sources`."""
+
+        entries = self._scan(branch)
+
+        # only branches that have an index file are part of the dataset
+        if self.index_file not in entries:
+            return
+
+        with open(os.path.join(branch, self.index_file)) as f:
+            # get the ordering for this scope
+            index = dict(json.load(f))['ordering']
+
+        for entry in index:
+
+            # a file and a directory with the same name in one scope: the file comes first.
+            # the root is not a module, so files can only be in the branches below it.
+            found = [ext for ext in self.supported_extensions
+                     if entries.get(entry + ext) is False and branch != self.data_root]
+
+            # with files in more than one format, the first supported extension wins
+            if found:
+                sources.append(os.path.join(branch, entry + found[0]))
+                self.ignored.extend(os.path.join(branch, entry + ext) for ext in found[1:])
+
+            if entries.get(entry) and entry not in self.ignore_dirs:
+                self._extract_branch(os.path.join(branch, entry), sources)
+
+    def _scan(self, branch):
+        """Returns a dict of the names in the `branch` directory, with True for directories."""
+
+        if scandir is None:
+            return dict((name, os.path.isdir(os.path.join(branch, name))) for name in os.listdir(branch))
+
+        return dict((entry.name, entry.is_dir()) for entry in scandir(branch))
+
+    def map_inventory(self):
+        """Takes the extracted data sources, and builds a new list of tuples like (model, data_source).
+
+        Getting the Model relies on a naming convention in the dataset:
+        * the data_source filename is the destination Model name, in lowercase, and the Model itself should be in title case.
+        * the data_source parent directory is the module that holds the Model
+
+        """
+
+        if self._inventory is None:
+            # walking the tree for the first time resets the inventory
+            sources = self.extract_sources()
+            self._inventory = []
+
+            for data_source in sources:
+                full_path, ext = os.path.splitext(data_source)
+                head, model_name = os.path.split(full_path)
+                head, module_name = os.path.split(head)
+                model = self.adapter.get_model(module_name, model_name.title())
+                self._inventory.append((model, data_source))
+
+        inventory = []
+        self.skipped = []
+
+        for model, data_source in self._inventory:
+
+            if self.manifest is not None and self.manifest.unchanged(data_source):
+                self.skipped.append(data_source)
+                continue
+
+            inventory.append((model, data_source))
+
+        return inventory
+
+    def dependency_graph(self):
+        """Returns the inventory, and for each of its entries, the indexes of the entries it depends on.
+
+        See `dependency_graph`. The ordering from the index files is kept, but only
+        between data sources whose models are related.
+
+        """
+
+        inventory = self.map_inventory()
+        return inventory, dependency_graph(inventory)
+
+
+class IncrementalUnload(Unload):
+
+    """Extracts only what changed in a git dataset repository since the last load.
+
+    The commit that was last loaded is kept in `state_file`, by default inside
+    the repository's git directory. `map_inventory` compares it with HEAD, and
+    returns only the data sources that changed, in the usual order. For CSV
+    data sources, the data source is a file-like object with the header and
+    only the rows that were added or changed; other data sources are loaded
+    whole. When no commit was recorded yet, the full inventory is returned.
+
+    Rows that were removed, or replaced by a changed version, are not removed
+    from the data store. Their count per data source is kept in `removed`.
+
+    After the inventory was processed successfully, call `commit` to record
+    the loaded commit:
+
+        unload = IncrementalUnload(data_root)
+        Process(unload.map_inventory())
+        unload.commit()
+
+    """
+
+    def __init__(self, data_root, state_file=None, **kwargs):
+
+        super(IncrementalUnload, self).__init__(data_root, **kwargs)
+        self.repository = self._git('rev-parse', '--show-toplevel', cwd=data_root).strip()
+
+        if state_file is None:
+            git_dir = self._git('rev-parse', '--git-dir', cwd=data_root).strip()
+            state_file = os.path.join(os.path.abspath(os.path.join(data_root, git_dir)), 'dock_last_load')
+
+        self.state_file = state_file
+        self.head = None
+        self.removed = {}
+
+    def last_commit(self):
+        """Returns the commit that was last loaded, or None."""
+
+        if not os.path.exists(self.state_file):
+            return None
+
+        with open(self.state_file) as f:
+            return f.read().strip() or None
+
+    def commit(self):
+        """Record the commit the inventory was mapped from as loaded."""
+
+        head = self.head or self._git('rev-parse', 'HEAD').strip()
+        write_atomic(self.state_file, head + '\n')
+
+    def map_inventory(self):
+
+        inventory = super(IncrementalUnload, self).map_inventory()
+        last = self.last_commit()
+        self.head = self._git('rev-parse', 'HEAD').strip()
+        self.removed = {}
+
+        if last is None:
+            return inventory
+
+        changed = self._git('diff', '--name-only', '-z', last, self.head, '--',
+                            os.path.relpath(os.path.realpath(self.data_root), self.repository))
+        changed = set(os.path.join(self.repository, path) for path in changed.split('\0') if path)
+
+        return [(model, self._changed_rows(last, data_source)) for model, data_source in inventory
+                if os.path.realpath(data_source) in changed]
+
+    def _changed_rows(self, last, data_source):
+        """Returns a data source with the rows of `data_source` that are not in the `last` commit."""
+
+        if not data_source.endswith('.csv'):
+            return data_source
+
+        path = os.path.relpath(os.path.realpath(data_source), self.repository)
+        new_rows = list(csv.reader(StringIO(self._git('show', self.head + ':' + path))))
+
+        try:
+            old_rows = list(csv.reader(StringIO(self._git('show', last + ':' + path))))
+        except subprocess.CalledProcessError:
+            # a new data source
+            old_rows = []
+
+        changed_rows = new_rows
+
+        # if the headers changed, every row did
+        if old_rows and new_rows and old_rows[0] == new_rows[0]:
+            old = Counter(tuple(row) for row in old_rows[1:])
+            changed_rows = [new_rows[0]]
+
+            for row in new_rows[1:]:
+                if old[tuple(row)]:
+                    old[tuple(row)] -= 1
+                else:
+                    changed_rows.append(row)
+
+            self.removed[data_source] = sum(old.values())
+
+        changed = StringIO()
+        csv.writer(changed).writerows(changed_rows)
+        changed.seek(0)
+
+        return changed
+
+    def _git(self, *args, **kwargs):
+
+        return subprocess.check_output(('git',) + args, cwd=kwargs.get('cwd') or self.repository)
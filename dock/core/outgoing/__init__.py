@@ -0,0 +1,304 @@
+import os
+import csv
+import json
+import time
+import threading
+from collections import OrderedDict
+from dock import config
+from dock.core.incoming import WorkerPool, file_hash, write_atomic
+
+
+class ExportError(Exception):
+
+    """Raised by Export when models failed to export concurrently, with the model and traceback of each in `errors`."""
+
+    def __init__(self, errors):
+
+        super(ExportError, self).__init__('%s of the models failed to export:\n%s' % (len(errors), '\n'.join(errors)))
+        self.errors = errors
+
+
+class Pack(object):
+
+    """Takes a list of models, and lays them out in the dataset directory conventions.
+
+    This is the outgoing counterpart of incoming.Unload. Each model gets a data
+    source at <data_root>/<app_label>/<model_name_lower_case>.csv, and the index
+    files declare an ordering where every model comes after the models it
+    relates to, so the dataset can be loaded back as it is.
+
+    Apps are ordered by their first model, so relations that go back and forth
+    between two apps can't all be honored by the ordering.
+
+    """
+
+    def __init__(self, data_root, models, index_file='index.json', extension='.csv'):
+
+        self.data_root = data_root
+        self.models = list(models)
+        self.index_file = index_file
+        self.extension = extension
+
+    def ordered_models(self):
+        """Returns the models, each after the models it relates to, and otherwise in the order given."""
+
+        remaining = list(self.models)
+        ordered = []
+
+        while remaining:
+            for model in remaining:
+                if not [other for other in self._related_models(model) if other in remaining and other is not model]:
+                    break
+            else:
+                # a cycle, we can only keep the order we were given
+                model = remaining[0]
+
+            remaining.remove(model)
+            ordered.append(model)
+
+        return ordered
+
+    def map_inventory(self):
+        """Returns a list of tuples like (model, destination), ordered like the index files."""
+
+        inventory = []
+
+        for model in self.ordered_models():
+            destination = os.path.join(self.data_root, model._meta.app_label,
+                                       model.__name__.lower() + self.extension)
+            inventory.append((model, destination))
+
+        return inventory
+
+    def write_indexes(self):
+        """Write the index files for the inventory, keeping what existing index files already order."""
+
+        apps = OrderedDict()
+
+        for model in self.ordered_models():
+            apps.setdefault(model._meta.app_label, []).append(model.__name__.lower())
+
+        self._write_index(self.data_root, apps.keys())
+
+        for app_label, model_names in apps.iteritems():
+            self._write_index(os.path.join(self.data_root, app_label), model_names)
+
+    def _write_index(self, directory, entries):
+
+        path = os.path.join(directory, self.index_file)
+        index = {'ordering': []}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+
+        ordering = index['ordering']
+        ordering.extend(entry for entry in entries if entry not in ordering)
+        content = json.dumps(index, indent=4, sort_keys=True, separators=(',', ': ')) + '\n'
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # an index that did not change is not touched, so it does not show up in the dataset repository
+        if os.path.exists(path):
+            with open(path) as f:
+                if f.read() == content:
+                    return
+
+        write_atomic(path, content)
+
+    def _related_models(self, model):
+
+        fields = model._meta.fields + model._meta.many_to_many
+        return set(field.rel.to for field in fields if field.rel)
+
+
+class Export(object):
+
+    """Takes data, as list of tuples, and writes it from the data store to the file system.
+
+    This is the outgoing counterpart of incoming.Process. Each tuple passed in
+    the list has the following signature:
+
+    (model, destination)
+
+    Where:
+
+    * *model* is the model to export
+    * *destination* is the path of the CSV file to write, as made by Pack
+
+    The objects of each model are read in chunks of `chunk_size`, by primary key,
+    and written out as they are read, so a table is never held in memory whole.
+    Foreign keys are written as the primary key of the related object, and many
+    to many fields as the primary keys of the related objects, separated by
+    DOCK_FIELD_ARGS_SEPARATOR. Their headers name the lookup, like `category*pk`,
+    so incoming.Store matches them by primary key before any other field. Every
+    row has its `id`, which Store and BulkStore read as an update of the object
+    with that id, or an insert with that id when there is none.
+
+    With `workers` greater than 1, that many models are exported concurrently,
+    each by its own thread. When models fail, the others are still exported,
+    and an ExportError is raised at the end, with the error of each. The
+    number of rows written and the time it took per model are kept on the
+    instance as `timings`.
+
+    The output is deterministic: rows are sorted by primary key, columns are in
+    field order, and lines end with a newline. Each file is written next to its
+    destination first, and only replaces the destination when their content
+    differs, so an unchanged model leaves its file untouched. The destinations
+    that were replaced are kept on the instance as `changed`. Pass
+    `skip_unchanged=False` to always replace them.
+
+    """
+
+    def __init__(self, inventory, chunk_size=None, workers=1, skip_unchanged=True):
+
+        if not isinstance(inventory, (list, tuple)):
+            raise AssertionError("Export requires inventory as a list or a tuple, you passed neither.")
+
+        self.inventory = inventory
+        self.chunk_size = chunk_size or config.DOCK_EXPORT_CHUNK_SIZE
+        self.workers = workers
+        self.skip_unchanged = skip_unchanged
+        self.timings = []
+        self.changed = []
+        self.write()
+
+    def write(self):
+        """Write the data of each model in the inventory to its destination."""
+
+        if self.workers > 1:
+            return self._write_concurrently()
+
+        for item in self.inventory:
+            model, destination = item
+            self._write_model(model, destination)
+
+    def _write_model(self, model, destination):
+
+        start = time.time()
+        headers, fields, many_to_many = self._columns(model)
+        rows = 0
+
+        directory = os.path.dirname(destination)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        tmp = destination + '.tmp'
+
+        try:
+            with open(tmp, 'wb') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(headers)
+
+                for chunk in self._chunks(model, fields, many_to_many):
+                    writer.writerows(chunk)
+                    rows += len(chunk)
+
+            if not (self.skip_unchanged and self._same_content(tmp, destination)):
+                os.rename(tmp, destination)
+                self.changed.append(destination)
+
+        finally:
+            # unchanged, or a query failed: either way it does not belong in the dataset repository
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        self.timings.append({
+            'model': model._meta.app_label + '.' + model.__name__,
+            'rows': rows,
+            'seconds': time.time() - start,
+            'worker': threading.current_thread().name,
+        })
+
+    def _same_content(self, path, other):
+
+        if not os.path.exists(other) or os.path.getsize(path) != os.path.getsize(other):
+            return False
+
+        return file_hash(path) == file_hash(other)
+
+    def _columns(self, model):
+        """Returns the headers, the concrete fields and the many to many fields of `model`."""
+
+        fields = list(model._meta.fields)
+        many_to_many = list(model._meta.many_to_many)
+        headers = [field.name + config.DOCK_HEADER_ARGS_SEPARATOR + 'pk' if field.rel else field.name
+                   for field in fields + many_to_many]
+
+        return headers, fields, many_to_many
+
+    def _chunks(self, model, fields, many_to_many):
+        """Yield the rows of `model`, ordered by primary key, a chunk at a time.
+
+        Each chunk is one query, that starts after the last primary key of the
+        previous chunk, plus one query per many to many field.
+
+        """
+
+        attnames = [field.attname for field in fields]
+        pk_index = attnames.index(model._meta.pk.attname)
+        queryset = model._default_manager.order_by('pk')
+        last = None
+
+        while True:
+            chunk_queryset = queryset if last is None else queryset.filter(pk__gt=last)
+            chunk = list(chunk_queryset.values_list(*attnames)[:self.chunk_size])
+
+            if not chunk:
+                return
+
+            last = chunk[-1][pk_index]
+            related = [self._related_pks(field, [values[pk_index] for values in chunk]) for field in many_to_many]
+
+            rows = []
+            for values in chunk:
+                row = [self._serialize(value) for value in values]
+                for pks in related:
+                    row.append(config.DOCK_FIELD_ARGS_SEPARATOR.join(
+                        self._serialize(pk) for pk in pks.get(values[pk_index], ())))
+                rows.append(row)
+
+            yield rows
+
+    def _related_pks(self, field, pks):
+        """Returns the related primary keys of a many to many field, for each of `pks`, with one query."""
+
+        related = {}
+        pairs = field.rel.through._default_manager.filter(**{
+            field.m2m_field_name() + '__in': pks
+        }).order_by(field.m2m_reverse_field_name()).values_list(field.m2m_field_name(),
+                                                                 field.m2m_reverse_field_name())
+
+        for pk, related_pk in pairs:
+            related.setdefault(pk, []).append(related_pk)
+
+        return related
+
+    def _serialize(self, value):
+
+        if value is None:
+            return ''
+
+        return unicode(value).encode('utf-8')
+
+    def _write_concurrently(self):
+        """Export the models with a pool of threads. Exports don't depend on each other."""
+
+        pool = WorkerPool(lambda item: self._write_model(*item), min(self.workers, len(self.inventory)))
+        errors = []
+
+        try:
+            for item in self.inventory:
+                pool.put(item)
+
+            for item in self.inventory:
+                (model, destination), e, tb = pool.get()
+                if e is not None:
+                    errors.append('%s.%s: %s' % (model._meta.app_label, model.__name__, tb))
+
+        finally:
+            pool.close()
+
+        if errors:
+            raise ExportError(errors)
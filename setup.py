@@ -11,4 +11,7 @@ setup(name='dock',
       license='BSD',
       packages=['dock', 'dock.core', 'dock.core.incoming', 'dock.core.outgoing',
                 'dock.contrib', 'dock.contrib.django', 'dock.contrib.fabric'],
+      entry_points={
+          'console_scripts': ['dock = dock.cli:main'],
+      },
       zip_safe=False)
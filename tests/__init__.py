@@ -0,0 +1,27 @@
+"""Tests for dock, run with `python -m unittest discover` from the repository root."""
+import os
+import atexit
+import django
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+if hasattr(django, 'setup'):
+    django.setup()
+
+# the tables of tests.models, in a database file of this run that is removed when it is over
+from django.conf import settings
+from django.core.management import call_command
+
+DATABASE = settings.DATABASES['default']['NAME']
+if os.path.exists(DATABASE):
+    os.remove(DATABASE)
+
+call_command('migrate', verbosity=0, interactive=False)
+
+
+@atexit.register
+def remove_database():
+
+    if os.path.exists(DATABASE):
+        os.remove(DATABASE)
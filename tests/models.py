@@ -0,0 +1,28 @@
+from django.db import models
+
+
+class Place(models.Model):
+    name = models.CharField(max_length=50)
+    price = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    count = models.IntegerField(default=1)
+    note = models.CharField(max_length=50, null=True, blank=True)
+
+
+class Visit(models.Model):
+    place = models.ForeignKey(Place)
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50)
+
+
+class Book(models.Model):
+    name = models.CharField(max_length=50)
+    pages = models.IntegerField(default=0)
+    tags = models.ManyToManyField(Tag, blank=True)
+    sequel = models.ForeignKey('self', null=True, blank=True)
+
+
+class Note(models.Model):
+    book = models.ForeignKey(Book, related_name='notes')
+    text = models.CharField(max_length=50)
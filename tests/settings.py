@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        # a file, not memory, so the processes of a sharded load share it
+        'NAME': os.path.join(tempfile.gettempdir(), 'dock-tests-%s.sqlite3' % os.getpid()),
+    }
+}
+
+INSTALLED_APPS = ['tests']
+
+SECRET_KEY = 'dock-tests'
@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+import unittest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from dock.core.incoming import DatasetCache, LookupCache, Process, Store
+from tests.models import Place, Visit, Tag
+
+
+class LookupCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        for model in (Visit, Place, Tag):
+            model.objects.all().delete()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_eviction(self):
+
+        cache = LookupCache(max_size=2)
+        cache.set(Place, 'name', u'a', 1)
+        cache.set(Place, 'name', u'b', 2)
+
+        # a hit makes `a` the most recently used, so `b` goes first
+        self.assertEqual(cache.get(Place, 'name', u'a'), (True, 1))
+        cache.set(Place, 'name', u'c', 3)
+
+        self.assertEqual(cache.get(Place, 'name', u'b'), (False, None))
+        self.assertEqual(cache.get(Place, 'name', u'a'), (True, 1))
+        self.assertEqual(cache.get(Place, 'name', u'c'), (True, 3))
+        self.assertEqual(cache.stats()['size'], 2)
+
+        # keyed by the unicode value, like the values read from data sources
+        cache.set(Place, 'pk', 5, 4)
+        self.assertEqual(cache.get(Place, 'pk', u'5'), (True, 4))
+
+    def test_counts(self):
+
+        cache = LookupCache()
+        cache.get(Place, 'name', u'a')
+        cache.set(Place, 'name', u'a', 1)
+        cache.get(Place, 'name', u'a')
+        cache.get(Place, 'name', u'a')
+
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 1, 'prefetched': []})
+
+    def test_invalidate(self):
+
+        cache = LookupCache()
+        cache.set(Place, 'name', u'a', 1)
+        cache.set(Tag, 'name', u'a', 2)
+        cache.get(Tag, 'pk', u'1')
+
+        cache.invalidate(Place)
+
+        self.assertEqual(cache.get(Place, 'name', u'a'), (False, None))
+        self.assertEqual(cache.get(Tag, 'name', u'a'), (True, 2))
+
+        # a prefetched index is built again after
+        cache = LookupCache(prefetch=True)
+        cache.get(Tag, 'name', u't')
+        Tag.objects.create(name=u't')
+        self.assertIsInstance(cache.get(Tag, 'name', u't')[1], Tag.DoesNotExist)
+
+        cache.invalidate(Tag)
+        self.assertEqual(cache.get(Tag, 'name', u't')[1].name, u't')
+
+    def test_cached_misses(self):
+
+        Place.objects.create(name=u'a')
+        cache = LookupCache()
+        store = Store(Visit, [], lookup_cache=cache)
+
+        with CaptureQueriesContext(connection) as queries:
+            for n in range(3):
+                with self.assertRaises(Place.DoesNotExist):
+                    store._find_instance(Place, u'missing')
+
+        # the name is queried the first time only, the other lookup fields can't hold it
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertIsInstance(cache.get(Place, 'name', u'missing')[1], Place.DoesNotExist)
+
+    def test_prefetch(self):
+
+        for n in range(5):
+            Place.objects.create(name=u'p%s' % n)
+        path = self.write('visit.csv', 'place,id\n' + ''.join('p%s,\n' % (n % 5) for n in range(20)))
+
+        with CaptureQueriesContext(connection) as queries:
+            process = Process([(Visit, path)], stream=True, prefetch=True)
+
+        # all the places in one query, and every lookup answered from it
+        lookups = [query['sql'] for query in queries.captured_queries if 'FROM "tests_place"' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+        self.assertNotIn('WHERE', lookups[0])
+
+        self.assertEqual(Visit.objects.count(), 20)
+        self.assertEqual(process.lookup_cache.hits, 20)
+        self.assertEqual(process.lookup_cache.stats()['prefetched'], ['Place'])
+
+
+class DatasetCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_get(self):
+
+        path = self.write('place.csv', 'name,count,note\ncaf\xc3\xa9,1,\nb,,x\n')
+        process = Process([], cache_dir=self.cache_dir)
+
+        parsed = process._dataset(Place, path)
+        self.assertEqual((process.dataset_cache.hits, process.dataset_cache.misses), (0, 1))
+
+        # the empty cells of each object are missing from it, like they are when parsed
+        cached = process._dataset(Place, path)
+        self.assertEqual((process.dataset_cache.hits, process.dataset_cache.misses), (1, 1))
+        self.assertEqual(cached, parsed)
+        self.assertEqual(cached, [{u'name': u'caf\xe9', u'count': u'1'}, {u'name': u'b', u'note': u'x'}])
+
+    def test_key(self):
+
+        path = self.write('place.csv', 'name,count\na,1\n')
+        cache = DatasetCache(self.cache_dir)
+        key = cache.key(path)
+
+        # touched, the same content
+        os.utime(path, (0, 0))
+        self.assertEqual(cache.key(path), key)
+
+        self.write('place.csv', 'name,count\na,2\n')
+        self.assertNotEqual(cache.key(path), key)
+
+    def test_broken_entries(self):
+
+        cache = DatasetCache(self.cache_dir)
+        cache.set('key', [{u'name': u'a', u'count': u'1'}, {u'name': u'b'}])
+
+        with open(os.path.join(self.cache_dir, 'key'), 'rb') as f:
+            content = f.read()
+
+        for broken in ('', content[:len(content) // 2]):
+            with open(os.path.join(self.cache_dir, 'key'), 'wb') as f:
+                f.write(broken)
+
+            self.assertIsNone(cache.get('key'))
+
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+from StringIO import StringIO
+from dock import cli
+from dock.core import incoming
+from dock.core.incoming import get_model
+from tests.models import Place, Visit
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_lazy_imports(self):
+
+        script = ("import sys, dock\n"
+                  "from dock.core.incoming import Unload\n"
+                  "Unload(sys.argv[1]).manifest\n"
+                  "print(' '.join(name for name in ('django', 'tablib') if name in sys.modules))\n")
+        env = dict(os.environ)
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+
+        # nothing heavy is imported until it is used
+        output = subprocess.check_output([sys.executable, '-c', script, tempfile.gettempdir()], env=env,
+                                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(output.strip(), '')
+
+    def test_get_model(self):
+
+        django_get_model = incoming.lazy.django_get_model
+        calls = []
+
+        # older versions of Django return None for a model that is not registered yet
+        def late_get_model(app_label, model_name):
+            calls.append(model_name)
+            return Place if len(calls) > 1 else None
+
+        incoming._models.pop(('tests', 'Place'), None)
+        incoming.lazy.django_get_model = late_get_model
+
+        try:
+            self.assertIsNone(get_model('tests', 'Place'))
+            self.assertNotIn(('tests', 'Place'), incoming._models)
+
+            # asked for again, and found, it is not asked for after
+            self.assertIs(get_model('tests', 'Place'), Place)
+            self.assertIs(get_model('tests', 'Place'), Place)
+
+        finally:
+            incoming.lazy.django_get_model = django_get_model
+
+        self.assertEqual(calls, ['Place', 'Place'])
+
+        # Django 1.8 raises for models it does not know
+        with self.assertRaises(LookupError):
+            get_model('tests', 'Missing')
+        self.assertNotIn(('tests', 'Missing'), incoming._models)
+
+
+class MainTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.root = os.path.join(self.directory, 'data')
+
+        self.write('index.json', json.dumps({'ordering': ['tests']}))
+        self.write('tests/index.json', json.dumps({'ordering': ['place', 'visit']}))
+        self.write('tests/place.csv', 'name,count\na,1\nb,2\n')
+
+    def tearDown(self):
+
+        for model in (Visit, Place):
+            model.objects.all().delete()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.root, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def main(self, *args):
+        """Run the command line with `args`, and return its exit status, output and error output."""
+
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+
+        try:
+            status = cli.main(list(args))
+            return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_load(self):
+
+        self.write('tests/visit.csv', 'place,id\na,\n')
+        stats = os.path.join(self.directory, 'stats.json')
+
+        status, output, errors = self.main(self.root, '--settings', 'tests.settings', '--bulk', '--stream',
+                                           '--stats', stats, '--manifest', 'manifest')
+
+        self.assertEqual(status, 0)
+        self.assertIn('2 data sources', errors)
+        self.assertEqual(sorted(Place.objects.values_list('name', flat=True)), [u'a', u'b'])
+        self.assertEqual(Visit.objects.get().place.name, u'a')
+
+        with open(stats) as f:
+            self.assertEqual(json.load(f)['models']['tests.Place']['rows'], 2)
+
+        # the manifest leaves nothing to load the second time
+        status, output, errors = self.main(self.root, '--manifest', 'manifest')
+        self.assertIn('0 data sources', errors)
+
+    def test_dry_run(self):
+
+        self.write('tests/visit.csv', 'place,id\nc,\n')
+
+        status, output, errors = self.main(self.root, '--dry-run')
+
+        self.assertEqual(status, 1)
+        self.assertEqual([problem['value'] for problem in json.loads(output)['unresolved']], [u'c'])
+        self.assertEqual(Place.objects.count(), 0)
+
+        self.write('tests/visit.csv', 'place,id\na,\n')
+        status, output, errors = self.main(self.root, '--dry-run', '--workers', '2')
+        self.assertEqual(status, 0)
+        self.assertTrue(json.loads(output)['valid'])
@@ -0,0 +1,103 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from dock.core.incoming import DBAPIAdapter, PandasParser, Process
+from tests.models import Place, Visit
+
+
+class DBAPIAdapterTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.connection = sqlite3.connect(os.path.join(self.directory, 'dock.sqlite3'))
+        self.connection.execute('CREATE TABLE "tests_place" ("id" integer PRIMARY KEY, "name" varchar(50) NOT NULL, '
+                                '"price" decimal NOT NULL, "count" integer NOT NULL, "note" varchar(50) NULL)')
+        self.connection.commit()
+
+    def tearDown(self):
+
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def rows(self):
+
+        return self.connection.execute('SELECT "name", "price", "count", "note" FROM "tests_place" '
+                                       'ORDER BY "name"').fetchall()
+
+    def write(self, name, content):
+
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_placeholder(self):
+
+        self.assertEqual(DBAPIAdapter(self.connection).placeholder, '?')
+        self.assertEqual(DBAPIAdapter(object()).placeholder, '%s')
+        self.assertEqual(DBAPIAdapter(self.connection, placeholder=':1').placeholder, ':1')
+
+    def test_process(self):
+
+        path = self.write('place.csv', 'name,price,count\nb,2.50,3\na,1.25,2\n')
+        Process([(Place, path)], adapter=DBAPIAdapter(self.connection))
+
+        self.assertEqual(self.rows(), [(u'a', 1.25, 2, None), (u'b', 2.5, 3, None)])
+
+    def test_defaults(self):
+
+        adapter = DBAPIAdapter(self.connection)
+        rows = adapter.save(Process([]), Place, [{'name': u'a'}, {'name': u'b', 'note': u'n', 'count': u'5'}])
+
+        self.assertEqual(rows, 2)
+        self.assertEqual(self.rows(), [(u'a', 0, 1, None), (u'b', 0, 5, u'n')])
+
+    def test_batches(self):
+
+        adapter = DBAPIAdapter(self.connection, batch_size=2)
+        batches = []
+        insert = adapter._insert
+        adapter._insert = lambda cursor, model, headers, objs: batches.append(len(objs)) or \
+            insert(cursor, model, headers, objs)
+
+        objs = [{'name': unicode(n)} for n in range(5)] + [{'name': u'n', 'note': u'n'}]
+        self.assertEqual(adapter.save(Process([]), Place, objs), 6)
+
+        self.assertEqual(len(self.rows()), 6)
+        self.assertEqual(batches, [2, 2, 1, 1])
+
+    def test_unicode(self):
+
+        path = self.write('place.csv', 'name,note\ncaf\xc3\xa9,\xc3\xa9t\xc3\xa9\n')
+        Process([(Place, path)], adapter=DBAPIAdapter(self.connection), stream=True)
+
+        self.assertEqual(self.rows(), [(u'caf\xe9', 0, 1, u'\xe9t\xe9')])
+
+    def test_unicode_pandas(self):
+
+        path = self.write('place.csv', 'name,note\ncaf\xc3\xa9,\xc3\xa9t\xc3\xa9\n')
+
+        # sqlite3 would take UTF-8 bytes too, the ORM does not
+        objs = list(PandasParser().parse(Process([]), Place, path))
+        self.assertEqual(objs, [{u'name': u'caf\xe9', u'note': u'\xe9t\xe9'}])
+        self.assertTrue(all(isinstance(value, unicode) for value in objs[0].values()))
+
+        Process([(Place, path)], adapter=DBAPIAdapter(self.connection), parser='pandas')
+        self.assertEqual(self.rows(), [(u'caf\xe9', 0, 1, u'\xe9t\xe9')])
+
+    def test_relation(self):
+
+        adapter = DBAPIAdapter(self.connection)
+
+        with self.assertRaises(AssertionError):
+            adapter.save(Process([]), Visit, [{'place': u'1'}])
+
+    def test_unknown_field(self):
+
+        adapter = DBAPIAdapter(self.connection)
+
+        with self.assertRaises(AssertionError):
+            adapter.save(Process([]), Place, [{'name': u'a', 'colour': u'red'}])
@@ -0,0 +1,187 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from dock.core.incoming import Process, Unload
+from dock.core.outgoing import Export, ExportError, Pack
+from tests.models import Place, Visit, Tag, Book, Note
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.root = os.path.join(self.directory, 'data')
+
+    def tearDown(self):
+
+        for model in (Note, Book, Tag, Visit, Place):
+            model.objects.all().delete()
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+
+        with open(path) as f:
+            return f.read()
+
+    def books(self):
+
+        t = Tag.objects.create(pk=1, name=u't')
+        u = Tag.objects.create(pk=2, name=u'u')
+        second = Book.objects.create(pk=2, name=u'caf\xe9', pages=20)
+        first = Book.objects.create(pk=1, name=u'a', pages=10, sequel=second)
+        Book.objects.create(pk=3, name=u'c', pages=30)
+        first.tags.add(u, t)
+        second.tags.add(t)
+        Note.objects.create(pk=1, book=first, text=u'n')
+
+    def test_chunks(self):
+
+        for n in range(5):
+            Place.objects.create(pk=5 - n, name=u'p%s' % n, count=n)
+        destination = os.path.join(self.root, 'tests', 'place.csv')
+
+        with CaptureQueriesContext(connection) as queries:
+            export = Export([(Place, destination)], chunk_size=2)
+
+        # three chunks, and the empty one that ends them
+        selects = [query['sql'] for query in queries.captured_queries if 'FROM "tests_place"' in query['sql']]
+        self.assertEqual(len(selects), 4)
+
+        self.assertEqual(self.read(destination), 'id,name,price,count,note\n' + ''.join(
+            '%s,p%s,0.00,%s,\n' % (5 - n, n, n) for n in reversed(range(5))))
+        self.assertEqual(export.timings[0]['rows'], 5)
+        self.assertEqual(export.changed, [destination])
+
+    def test_relation_headers(self):
+
+        self.books()
+        books = os.path.join(self.root, 'tests', 'book.csv')
+        notes = os.path.join(self.root, 'tests', 'note.csv')
+
+        # the tags of books in different chunks are read with their chunk
+        Export([(Book, books), (Note, notes)], chunk_size=2)
+
+        self.assertEqual(self.read(books), 'id,name,pages,sequel*pk,tags*pk\n'
+                                           '1,a,10,2,1;2\n'
+                                           '2,caf\xc3\xa9,20,,1\n'
+                                           '3,c,30,,\n')
+        self.assertEqual(self.read(notes), 'id,book*pk,text\n1,1,n\n')
+
+    def test_write_indexes(self):
+
+        pack = Pack(self.root, [Note, Visit, Book, Tag, Place])
+
+        # every model after the models it relates to
+        self.assertEqual(pack.ordered_models(), [Tag, Book, Note, Place, Visit])
+        self.assertEqual(pack.map_inventory()[0], (Tag, os.path.join(self.root, 'tests', 'tag.csv')))
+
+        os.makedirs(os.path.join(self.root, 'tests'))
+        with open(os.path.join(self.root, 'tests', 'index.json'), 'w') as f:
+            json.dump({'ordering': ['place', 'other']}, f)
+
+        pack.write_indexes()
+
+        with open(os.path.join(self.root, 'index.json')) as f:
+            self.assertEqual(json.load(f), {'ordering': ['tests']})
+
+        # what the index already ordered stays first
+        with open(os.path.join(self.root, 'tests', 'index.json')) as f:
+            self.assertEqual(json.load(f), {'ordering': ['place', 'other', 'tag', 'book', 'note', 'visit']})
+
+        # an index that would not change is not written again
+        path = os.path.join(self.root, 'index.json')
+        os.utime(path, (0, 0))
+        pack.write_indexes()
+        self.assertEqual(os.path.getmtime(path), 0)
+
+    def test_round_trip(self):
+
+        self.books()
+        place = Place.objects.create(name=u'p', price='1.50', count=0, note=u'x, "y"')
+        Visit.objects.create(place=place)
+
+        models = [Place, Visit, Tag, Book, Note]
+        expected = [list(model.objects.order_by('pk').values()) for model in models]
+        tags = sorted(Book.tags.through.objects.values_list('book_id', 'tag_id'))
+
+        pack = Pack(self.root, models)
+        pack.write_indexes()
+        Export(pack.map_inventory(), chunk_size=2)
+
+        for model in reversed(models):
+            model.objects.all().delete()
+
+        unload = Unload(self.root)
+        self.assertEqual(unload.map_inventory(), pack.map_inventory())
+        Process(unload.map_inventory(), stream=True)
+
+        self.assertEqual([list(model.objects.order_by('pk').values()) for model in models], expected)
+        self.assertEqual(sorted(Book.tags.through.objects.values_list('book_id', 'tag_id')), tags)
+
+    def test_unchanged(self):
+
+        self.books()
+        inventory = Pack(self.root, [Tag, Book]).map_inventory()
+        Export(inventory)
+
+        for model, destination in inventory:
+            os.utime(destination, (0, 0))
+
+        # nothing changed, nothing is replaced
+        export = Export(inventory)
+        self.assertEqual(export.changed, [])
+        self.assertEqual([os.path.getmtime(destination) for model, destination in inventory], [0, 0])
+
+        # a row changed, only the file of its model is replaced
+        Book.objects.filter(pk=3).update(pages=31)
+        export = Export(inventory)
+        self.assertEqual(export.changed, [inventory[1][1]])
+        self.assertEqual(os.path.getmtime(inventory[0][1]), 0)
+        self.assertIn('3,c,31,,\n', self.read(inventory[1][1]))
+
+        export = Export(inventory, skip_unchanged=False)
+        self.assertEqual(export.changed, [destination for model, destination in inventory])
+
+    def test_failed_query(self):
+
+        Place.objects.create(name=u'p')
+        destination = os.path.join(self.root, 'tests', 'place.csv')
+
+        class FailingExport(Export):
+
+            def _chunks(self, model, fields, many_to_many):
+                yield [['1', 'p', '0.00', '1', '']]
+                raise ValueError(model)
+
+        with self.assertRaises(ValueError):
+            FailingExport([(Place, destination)])
+
+        # neither the destination nor the file written next to it are left
+        self.assertEqual(os.listdir(os.path.dirname(destination)), [])
+
+    def test_write_concurrently_errors(self):
+
+        written = []
+
+        class FailingExport(Export):
+
+            def _write_model(self, model, destination):
+                if model in (Place, Tag):
+                    raise ValueError(destination)
+                written.append(model)
+
+        inventory = [(model, model.__name__.lower() + '.csv') for model in (Place, Visit, Tag, Book, Note)]
+
+        with self.assertRaises(ExportError) as raised:
+            FailingExport(inventory, workers=2)
+
+        # every model is exported, and every error is reported
+        self.assertEqual(sorted(model.__name__ for model in written), ['Book', 'Note', 'Visit'])
+        self.assertEqual(sorted(error.split(':')[0] for error in raised.exception.errors),
+                         ['tests.Place', 'tests.Tag'])
+        self.assertIn('ValueError: place.csv', raised.exception.errors[0] + raised.exception.errors[1])
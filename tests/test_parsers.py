@@ -0,0 +1,146 @@
+import os
+import types
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from dock.core.incoming import CSVParser, JSONLinesParser, Process, TSVParser, XLSXParser
+from tests.models import Place, Tag, Book, Note
+
+
+class ParserTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        for model in (Note, Book, Tag, Place):
+            model.objects.all().delete()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def xlsx(self, name, rows):
+
+        import openpyxl
+
+        workbook = openpyxl.Workbook()
+        for row in rows:
+            workbook.active.append(row)
+
+        path = os.path.join(self.directory, name)
+        workbook.save(path)
+        return path
+
+    def test_stream(self):
+
+        normalized = []
+
+        class CountingProcess(Process):
+
+            def _normalize_header(self, header):
+                normalized.append(header)
+                return super(CountingProcess, self)._normalize_header(header)
+
+        path = self.write('place.csv', 'Na-me,"Co unt",note\ncaf\xc3\xa9,1,\nb,,x\n' + 'c,3,y\n' * 100)
+        process = CountingProcess([], stream=True)
+        dataset = process._dataset(Place, path)
+
+        # nothing is read until the dataset is iterated over
+        self.assertIsInstance(dataset, types.GeneratorType)
+        self.assertEqual(normalized, [])
+
+        objs = list(dataset)
+
+        # values are decoded, empty ones are dropped, and headers are cleaned once per data source
+        self.assertEqual(objs[:2], [{u'name': u'caf\xe9', u'count': u'1'}, {u'name': u'b', u'note': u'x'}])
+        self.assertEqual(len(objs), 102)
+        self.assertEqual(normalized, ['Na-me', 'Co unt', 'note'])
+        self.assertTrue(all(isinstance(value, unicode) for obj in objs for value in obj.itervalues()))
+
+    def test_stream_empty(self):
+
+        process = Process([], stream=True)
+
+        self.assertEqual(list(process._dataset(Place, self.write('place.csv', ''))), [])
+        self.assertEqual(list(process._dataset(Place, self.write('place.csv', 'name,count\n'))), [])
+        self.assertEqual(list(process._dataset(Place, StringIO('name,count\na,1\n'))),
+                         [{u'name': u'a', u'count': u'1'}])
+
+    def test_stream_datasets(self):
+
+        process = Process([], stream=True)
+        process.inventory = [(Place, self.write('place.csv', 'name,count\na,1\n')),
+                             (Place, self.write('place.tsv', 'name\tcount\nb\t2\n')),
+                             (Place, self.write('place.jsonl', '{"name": "c"}\n'))]
+
+        datasets = [dataset for model, dataset in process.processed()]
+
+        self.assertTrue(all(isinstance(dataset, types.GeneratorType) for dataset in datasets))
+        self.assertEqual([list(dataset) for dataset in datasets],
+                         [[{u'name': u'a', u'count': u'1'}], [{u'name': u'b', u'count': u'2'}], [{u'name': u'c'}]])
+
+    def test_tsv(self):
+
+        path = self.write('place.tsv', 'Name\tcount\tnote\ncaf\xc3\xa9\t1\t\nb\t2\tx, y\n')
+
+        self.assertEqual(list(TSVParser().parse(Process([]), Place, path)),
+                         [{u'name': u'caf\xe9', u'count': u'1'}, {u'name': u'b', u'count': u'2', u'note': u'x, y'}])
+
+    def test_jsonl(self):
+
+        path = self.write('book.jsonl', '{"Name": "a", "pages": 0, "tags": ["t", "u"], "sequel": null}\n\n'
+                                        '{"name": "caf\\u00e9", "tags": [], "notes*text": ""}\n')
+
+        # zeros are values, lists are joined, and empty values are dropped
+        self.assertEqual(list(JSONLinesParser().parse(Process([]), Book, path)),
+                         [{u'name': u'a', u'pages': 0, u'tags': u't;u'}, {u'name': u'caf\xe9'}])
+
+    def test_xlsx(self):
+
+        path = self.xlsx('place.xlsx', [['Name', 'count', 'note'], [u'caf\xe9', 1, None], ['b', 2, '']])
+
+        self.assertEqual(list(XLSXParser().parse(Process([]), Place, path)),
+                         [{u'name': u'caf\xe9', u'count': 1}, {u'name': u'b', u'count': 2}])
+
+    def test_scalar_relations(self):
+
+        tag = Tag.objects.create(name=u't')
+        jsonl = self.write('book.jsonl', '{"name": "a", "tags*pk": %s, "notes*text": 1}\n'
+                                         '{"name": "b", "tags*pk": [%s]}\n' % (tag.pk, tag.pk))
+        xlsx = self.xlsx('book.xlsx', [['name', 'tags*pk', 'notes*text'], ['c', tag.pk, 2]])
+
+        # numbers in relation columns are values like any other
+        process = Process([(Book, jsonl), (Book, xlsx)], dry_run=True)
+        self.assertTrue(process.validation.valid)
+
+        Process([(Book, jsonl), (Book, xlsx)])
+
+        self.assertEqual(sorted(Book.tags.through.objects.values_list('book__name', 'tag__name')),
+                         [(u'a', u't'), (u'b', u't'), (u'c', u't')])
+        self.assertEqual(sorted(Note.objects.values_list('book__name', 'text')), [(u'a', u'1'), (u'c', u'2')])
+
+    def test_parser_for(self):
+
+        csv = self.write('place.csv', 'name,count\na,1\n')
+        tsv = self.write('place.tsv', 'name\tcount\na\t1\n')
+
+        # a parser for the run reads CSV only, the other formats keep theirs
+        process = Process([], parser='csv')
+        self.assertIs(type(process._parser_for(csv)), CSVParser)
+        self.assertIs(type(process._parser_for(tsv)), TSVParser)
+        self.assertIs(type(process._parser_for(os.path.join(self.directory, 'place.jsonl'))), JSONLinesParser)
+
+        # unless a dict names another for that extension
+        process = Process([], parser={'.tsv': 'csv'})
+        self.assertIs(type(process._parser_for(tsv)), CSVParser)
+
+        Process([(Place, tsv)], parser='pandas')
+        self.assertEqual(list(Place.objects.values_list('name', 'count')), [(u'a', 1)])
@@ -0,0 +1,505 @@
+import os
+import json
+import shutil
+import tempfile
+import types
+import unittest
+from decimal import Decimal
+from dock import config
+from dock.core.incoming import (BulkStore, CSVRangeParser, DatasetProcessor, LoadPlan, LoadStats, Pipeline, Process,
+                                SaveError, ShardError, Unload, dependency_graph, line_ranges)
+from tests.models import Place, Visit, Tag, Book, Note
+
+
+class ProcessTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        for model in (Note, Book, Tag, Visit, Place):
+            model.objects.all().delete()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def places(self, name, count):
+
+        return self.write(name, 'name,count\n' + ''.join('p%s,%s\n' % (n, n) for n in range(count)))
+
+    def test_no_shards_with_checkpoint(self):
+
+        path = self.places('place.csv', 20)
+        min_size = config.DOCK_SHARD_MIN_SIZE
+        config.DOCK_SHARD_MIN_SIZE = 0
+
+        try:
+            process = Process([], stream=True, shards=2)
+            self.assertEqual(process._shard_delimiter(Place, path), ',')
+
+            process = Process([], shards=2, checkpoint_file=os.path.join(self.directory, 'checkpoint'))
+            self.assertIsNone(process._shard_delimiter(Place, path))
+
+            process = Process([(Place, path)], stream=True, shards=2, commit_every=5,
+                              checkpoint_file=os.path.join(self.directory, 'checkpoint'))
+
+        finally:
+            config.DOCK_SHARD_MIN_SIZE = min_size
+
+        self.assertEqual(process.shard_results, [])
+        self.assertEqual(Place.objects.count(), 20)
+
+    def test_line_ranges(self):
+
+        path = self.places('place.csv', 10)
+        header_end, ranges = line_ranges(path, 3)
+
+        self.assertEqual(header_end, len('name,count\n'))
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual((ranges[0][0], ranges[-1][1]), (header_end, os.path.getsize(path)))
+
+        # each range starts where the one before it ends, at the start of a line
+        with open(path, 'rb') as f:
+            content = f.read()
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(content[end - 1], '\n')
+
+        # more ranges than lines, none of them empty
+        path = self.places('small.csv', 2)
+        header_end, ranges = line_ranges(path, 10)
+        self.assertLessEqual(len(ranges), 2)
+
+        rows = []
+        for start, end in ranges:
+            rows.extend(CSVRangeParser(start, end, [u'name', u'count']).parse(None, Place, path))
+        self.assertEqual(rows, [{u'name': u'p0', u'count': u'0'}, {u'name': u'p1', u'count': u'1'}])
+
+    def test_range_parser(self):
+
+        path = self.write('place.csv', 'name,count\nb\xc3\xa9,1\nc,\nd,3\n')
+        start = len('name,count\nb\xc3\xa9,1\n')
+        parser = CSVRangeParser(start, os.path.getsize(path) - len('d,3\n'), [u'name', u'count'])
+
+        # only the lines of the range, and empty values are dropped
+        self.assertEqual(list(parser.parse(None, Place, path)), [{u'name': u'c'}])
+
+        parser = CSVRangeParser(len('name,count\n'), start, [u'name', u'count'])
+        self.assertEqual(list(parser.parse(None, Place, path)), [{u'name': u'b\xe9', u'count': u'1'}])
+
+    def test_shards(self):
+
+        path = self.places('place.csv', 2000)
+        min_size = config.DOCK_SHARD_MIN_SIZE
+        config.DOCK_SHARD_MIN_SIZE = 0
+
+        try:
+            process = Process([(Place, path)], storage_class=BulkStore, stream=True, shards=3)
+        finally:
+            config.DOCK_SHARD_MIN_SIZE = min_size
+
+        self.assertEqual(sorted(Place.objects.values_list('count', flat=True)), range(2000))
+        self.assertEqual(len(process.shard_results), 3)
+        self.assertEqual(sum(result['rows'] for result in process.shard_results), 2000)
+        self.assertEqual([result['error'] for result in process.shard_results], [None] * 3)
+        self.assertEqual(process.timings[0]['rows'], 2000)
+
+    def test_shards_error(self):
+
+        path = self.write('place.csv', 'name,count\n' + ''.join('p%s,%s\n' % (n, 'x' if n == 1990 else n)
+                                                                 for n in range(2000)))
+        min_size = config.DOCK_SHARD_MIN_SIZE
+        config.DOCK_SHARD_MIN_SIZE = 0
+
+        try:
+            with self.assertRaises(ShardError) as raised:
+                Process([(Place, path)], storage_class=BulkStore, stream=True, shards=3)
+        finally:
+            config.DOCK_SHARD_MIN_SIZE = min_size
+
+        # the shards that could be saved were
+        self.assertEqual(len(raised.exception.errors), 1)
+        self.assertIn('ValueError', raised.exception.errors[0])
+        self.assertGreater(Place.objects.count(), 0)
+
+    def test_stats_extract(self):
+
+        first = self.places('first.csv', 50)
+        second = self.places('second.csv', 20)
+        extracts = []
+
+        def callback(model, phase, seconds):
+            if phase == 'extract':
+                extracts.append(seconds)
+
+        process = Process([(Place, first), (Place, second)], stream=True, stats=LoadStats(callbacks=[callback]))
+
+        # the time it took to read each streamed dataset is recorded once, not per row
+        self.assertEqual(len(extracts), 2)
+        self.assertEqual(process.stats.models['tests.Place']['phases']['extract'], sum(extracts))
+        self.assertEqual(process.stats.models['tests.Place']['rows'], 70)
+
+    def tree(self, sources):
+        """Write a dataset tree with the `sources` of the tests app, in order, and return its root."""
+
+        root = os.path.join(self.directory, 'data')
+        os.makedirs(os.path.join(root, 'tests'))
+
+        with open(os.path.join(root, 'index.json'), 'w') as f:
+            json.dump({'ordering': ['tests']}, f)
+
+        with open(os.path.join(root, 'tests', 'index.json'), 'w') as f:
+            json.dump({'ordering': [name for name, content in sources]}, f)
+
+        for name, content in sources:
+            self.write(os.path.join('data', 'tests', name + '.csv'), content)
+
+        return root
+
+    def test_resume(self):
+
+        path = self.write('place.csv', 'name,count\n' + ''.join('p%s,%s\n' % (n, 'x' if n == 7 else n)
+                                                                 for n in range(12)))
+        checkpoint = os.path.join(self.directory, 'checkpoint')
+
+        with self.assertRaises(ValueError):
+            Process([(Place, path)], commit_every=5, checkpoint_file=checkpoint, stream=True)
+
+        # the first commit is kept, and recorded
+        self.assertEqual(Place.objects.count(), 5)
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f), {path: 5})
+
+        self.places('place.csv', 12)
+        process = Process([(Place, path)], commit_every=5, checkpoint_file=checkpoint, stream=True)
+
+        self.assertEqual(sorted(Place.objects.values_list('count', flat=True)), range(12))
+        self.assertEqual([commit['rows'] for commit in process.commits], [5, 2])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_resume_with_manifest(self):
+
+        root = self.tree([
+            ('tag', 'name,id\nt,\nu,\n'),
+            ('place', 'name,count\n' + ''.join('p%s,%s\n' % (n, 'x' if n == 7 else n) for n in range(12))),
+        ])
+        checkpoint = os.path.join(self.directory, 'checkpoint')
+
+        unload = Unload(root, manifest_file='manifest')
+        with self.assertRaises(ValueError):
+            Process(unload.map_inventory(), manifest=unload.manifest, commit_every=5, checkpoint_file=checkpoint,
+                    stream=True)
+
+        self.write(os.path.join('data', 'tests', 'place.csv'),
+                   'name,count\n' + ''.join('p%s,%s\n' % (n, n) for n in range(12)))
+
+        # the tags were saved, and are not in the inventory anymore, so the places come first now
+        unload = Unload(root, manifest_file='manifest')
+        inventory = unload.map_inventory()
+        self.assertEqual(inventory, [(Place, os.path.join(root, 'tests', 'place.csv'))])
+        self.assertEqual(unload.skipped, [os.path.join(root, 'tests', 'tag.csv')])
+
+        Process(inventory, manifest=unload.manifest, commit_every=5, checkpoint_file=checkpoint, stream=True)
+
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertEqual(sorted(Place.objects.values_list('count', flat=True)), range(12))
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def save_concurrently(self, inventory, **kwargs):
+        """Run a Process with `workers`, and return the indexes of the datasets it saved, in order."""
+
+        saved = []
+
+        class RecordingProcess(Process):
+
+            def _save_dataset(self, model, dataset, index=None, data_source=None):
+                list(dataset)
+                saved.append(index)
+
+        RecordingProcess(inventory, workers=3, **kwargs)
+        return saved
+
+    def test_dependency_graph(self):
+
+        path = self.write('source.csv', 'name,id\na,\n')
+        inventory = [(Place, path), (Tag, path), (Visit, path), (Book, path), (Note, path), (Place, path)]
+
+        self.assertEqual(dependency_graph(inventory), [set(), set(), {0}, {1}, {3}, {0, 2}])
+
+    def test_save_concurrently(self):
+
+        path = self.write('source.csv', 'name,id\na,\n')
+        inventory = [(Place, path), (Tag, path), (Visit, path), (Book, path), (Note, path)]
+        dependencies = dependency_graph(inventory)
+
+        saved = self.save_concurrently(inventory)
+
+        self.assertEqual(sorted(saved), range(5))
+        for index, depends_on in enumerate(dependencies):
+            for other in depends_on:
+                self.assertLess(saved.index(other), saved.index(index))
+
+        # given dependencies replace the ones worked out from the models
+        saved = self.save_concurrently(inventory[:2], dependencies=[{1}, set()])
+        self.assertEqual(saved, [1, 0])
+
+        with self.assertRaises(AssertionError):
+            self.save_concurrently(inventory, dependencies=[set()])
+
+    def test_save_concurrently_stops_dependents(self):
+
+        path = self.write('source.csv', 'name,id\na,\n')
+        inventory = [(Tag, path), (Place, path), (Book, path), (Note, path), (Visit, path)]
+        saved = []
+
+        class FailingProcess(Process):
+
+            def _save_dataset(self, model, dataset, index=None, data_source=None):
+                if index in (0, 1):
+                    raise ValueError(index)
+                saved.append(index)
+
+        with self.assertRaises(SaveError) as raised:
+            FailingProcess(inventory, workers=2)
+
+        # the others depend on the tags and places that failed, and every failure is reported
+        self.assertEqual(saved, [])
+        self.assertEqual(sorted(error.split(':')[0] for error in raised.exception.errors),
+                         ['tests.Place', 'tests.Tag'])
+        self.assertIn('ValueError: 0', '\n'.join(raised.exception.errors))
+
+    def test_pipeline(self):
+
+        chunk_size = config.DOCK_PIPELINE_CHUNK_SIZE
+        config.DOCK_PIPELINE_CHUNK_SIZE = 2
+
+        def broken():
+            yield {'name': u'x'}
+            raise ValueError('broken')
+
+        try:
+            pipeline = Pipeline([(Place, [{'name': unicode(n)} for n in range(5)]),
+                                 (Place, [{'name': u'skipped'}]),
+                                 (Place, [{'name': unicode(n)} for n in range(5, 10)]),
+                                 (Place, [{'name': u'last'}]),
+                                 (Place, broken())], 1, skip=lambda index, item: index == 1)
+            datasets = pipeline.processed()
+
+            try:
+                self.assertEqual([obj['name'] for obj in datasets[0][1]], [u'0', u'1', u'2', u'3', u'4'])
+                self.assertEqual(list(datasets[1][1]), [])
+
+                # a dataset that is not read to its end is skipped by the next one
+                self.assertEqual(next(datasets[2][1]), {'name': u'5'})
+                self.assertEqual(list(datasets[3][1]), [{'name': u'last'}])
+
+                # errors while reading are raised where the dataset is read
+                with self.assertRaises(ValueError):
+                    list(datasets[4][1])
+
+            finally:
+                pipeline.stop()
+
+        finally:
+            config.DOCK_PIPELINE_CHUNK_SIZE = chunk_size
+
+    def test_pipeline_process(self):
+
+        first = self.places('first.csv', 30)
+        second = self.write('second.csv', 'name,count\nlast,1\n')
+        process = Process([(Place, first), (Place, second)], pipeline=2, stream=True)
+
+        self.assertEqual(Place.objects.count(), 31)
+        self.assertEqual([timing['rows'] for timing in process.timings], [30, 1])
+
+    def test_pipeline_stop(self):
+
+        pipeline = Pipeline([(Place, ({'name': unicode(n)} for n in range(100000)))], 1)
+        datasets = pipeline.processed()
+        next(datasets[0][1])
+
+        # the reader waits for room in the queue, and stops
+        pipeline.stop()
+        self.assertFalse(pipeline._thread.is_alive())
+
+    def test_coercer(self):
+
+        plan = LoadPlan(Place, config.DOCK_DIRECT_RELATION_TYPES)
+
+        self.assertEqual(plan.coercer(u'count')(u'7'), 7)
+        self.assertEqual(plan.coercer(u'price')(u'1.50'), Decimal('1.50'))
+        self.assertIs(plan.coercer(u'count'), plan.coercer(u'count'))
+
+        # text is not converted, and headers that are not fields are left for Store
+        self.assertIsNone(plan.coercer(u'name'))
+        self.assertIsNone(plan.coercer(u'colour'))
+        self.assertIsNone(LoadPlan(Visit, config.DOCK_DIRECT_RELATION_TYPES).coercer(u'place'))
+
+    def test_coerce(self):
+
+        process = Process([])
+
+        objs = process._coerce(Place, [{u'name': u'1', u'count': u'2'}, {u'price': u'1.5', u'colour': u'3'}])
+        self.assertEqual(objs, [{u'name': u'1', u'count': 2}, {u'price': Decimal('1.5'), u'colour': u'3'}])
+
+        chunk_size = config.DOCK_PARSER_CHUNK_SIZE
+        config.DOCK_PARSER_CHUNK_SIZE = 2
+
+        try:
+            # a streamed dataset stays a generator, a chunk at a time, with other columns in each chunk
+            objs = process._coerce(Place, ({u'count': unicode(n)} if n < 3 else {u'price': unicode(n)}
+                                           for n in range(5)))
+            self.assertIsInstance(objs, types.GeneratorType)
+            self.assertEqual(list(objs), [{u'count': 0}, {u'count': 1}, {u'count': 2},
+                                          {u'price': Decimal(3)}, {u'price': Decimal(4)}])
+        finally:
+            config.DOCK_PARSER_CHUNK_SIZE = chunk_size
+
+    def test_coerce_empty_cells(self):
+
+        path = self.write('place.csv', 'name,count,price\na,,1.5\nb,2,\n')
+
+        for stream in (False, True):
+            Process([(Place, path)], coerce=True, stream=stream)
+
+            # empty cells are dropped before coercing, so the fields keep their defaults
+            self.assertEqual(sorted(Place.objects.values_list('name', 'count', 'price')),
+                             [(u'a', 1, Decimal('1.50')), (u'b', 2, Decimal('0.00'))])
+            Place.objects.all().delete()
+
+    def test_processors(self):
+
+        batches = []
+        batches_seen = []
+
+        class Suffix(DatasetProcessor):
+
+            models = (Place,)
+
+            def __init__(self, suffix='a'):
+                self.suffix = suffix
+
+            def process_batch(self, model, batch):
+                batches.append((self.suffix, len(batch)))
+                for obj in batch:
+                    obj['name'] += self.suffix
+                return batch
+
+        class Unique(DatasetProcessor):
+
+            models = (Place,)
+            whole_models = (Place,)
+
+            def process(self, model, batches):
+                objs = [obj for batch in batches for obj in batch]
+                batches_seen.append(len(objs))
+                yield [obj for obj in objs if obj['name'] != u'p3ab']
+
+        places = self.places('place.csv', 7)
+        visits = self.write('visit.csv', 'place,id\np1ab,\n')
+        batch_size = config.DOCK_PROCESSOR_BATCH_SIZE
+        config.DOCK_PROCESSOR_BATCH_SIZE = 3
+
+        try:
+            # in order, as classes or instances, and the visits go past the processors for places
+            Process([(Place, places), (Visit, visits)], processors=[Suffix, Suffix('b'), Unique], stream=True)
+        finally:
+            config.DOCK_PROCESSOR_BATCH_SIZE = batch_size
+
+        self.assertEqual(sorted(Place.objects.values_list('name', flat=True)),
+                         [u'p%sab' % n for n in range(7) if n != 3])
+        self.assertEqual(Visit.objects.get().place.name, u'p1ab')
+
+        # batches of DOCK_PROCESSOR_BATCH_SIZE, each through the whole chain, and the whole dataset for Unique
+        self.assertEqual(batches, [('a', 3), ('b', 3), ('a', 3), ('b', 3), ('a', 1), ('b', 1)])
+        self.assertEqual(batches_seen, [7])
+
+        with self.assertRaises(AssertionError):
+            Process([], processors=[object()])
+
+    def test_process_batches(self):
+
+        read = []
+
+        def dataset():
+            for n in range(10):
+                read.append(n)
+                yield {'name': unicode(n)}
+
+        class Whole(DatasetProcessor):
+
+            whole_models = (Book,)
+
+        process = Process([], processors=[DatasetProcessor(), Whole()])
+        batch_size = config.DOCK_PROCESSOR_BATCH_SIZE
+        config.DOCK_PROCESSOR_BATCH_SIZE = 3
+
+        try:
+            # only a batch is read ahead of the objects that come out
+            objs = process._process_batches(Place, dataset())
+            next(objs)
+            self.assertEqual(read, [0, 1, 2])
+            self.assertEqual(len(list(objs)), 9)
+
+            # unless a processor gets the dataset whole
+            del read[:]
+            objs = process._process_batches(Book, dataset())
+            next(objs)
+            self.assertEqual(read, range(10))
+        finally:
+            config.DOCK_PROCESSOR_BATCH_SIZE = batch_size
+
+    def test_dry_run(self):
+
+        Tag.objects.create(name=u't')
+        places = self.write('place.csv', 'name,count,colour\na,1,red\nb,x,red\n')
+        books = self.write('book.csv', 'name,tags,sequel\none,t;u,two\ntwo,t,three\n')
+        visits = self.write('visit.csv', 'place,id\na,\nb,\nc,\n')
+
+        process = Process([(Place, places), (Book, books), (Visit, visits)], dry_run=True, stream=True)
+        report = process.validation.report()
+
+        # nothing is written
+        self.assertEqual(Place.objects.count(), 0)
+        self.assertEqual(Book.objects.count(), 0)
+
+        self.assertFalse(report['valid'])
+        self.assertEqual(report['rows'], 7)
+        self.assertEqual([(problem['header'], problem['rows']) for problem in report['unknown_headers']],
+                         [(u'colour', [1, 2])])
+        self.assertEqual([(problem['header'], problem['value']) for problem in report['type_errors']],
+                         [(u'count', u'x')])
+
+        # the tags and places checked earlier in the run count, and so do the books of the dataset itself
+        self.assertEqual(sorted((problem['model'], problem['value'], problem['rows'])
+                                for problem in report['unresolved']),
+                         [('tests.Book', u'three', [2]), ('tests.Book', u'u', [1]), ('tests.Visit', u'c', [3])])
+
+    def test_dry_run_coerce(self):
+
+        places = self.write('place.csv', 'name,count,price\na,x,1.5\nb,2,y\nc,z,2\n')
+
+        process = Process([(Place, places)], dry_run=True, coerce=True, stream=True)
+
+        # every value that does not convert is reported, not only the first
+        self.assertEqual(sorted((problem['header'], problem['value'])
+                                for problem in process.validation.report()['type_errors']),
+                         [(u'count', u'x'), (u'count', u'z'), (u'price', u'y')])
+        self.assertEqual(Place.objects.count(), 0)
+
+    def test_dry_run_valid(self):
+
+        places = self.write('place.csv', 'name,count\na,1\n')
+        visits = self.write('visit.csv', 'place,id\na,\n')
+
+        process = Process([(Place, places), (Visit, visits)], dry_run=True, stream=True)
+
+        self.assertTrue(process.validation.valid)
+        self.assertEqual(Place.objects.count(), 0)
@@ -0,0 +1,178 @@
+import os
+import shutil
+import tempfile
+import unittest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from dock.core.incoming import Store, BulkStore, LoadPlan, Process
+from dock import config
+from tests.models import Place, Visit, Tag, Book, Note
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        for model in (Note, Book, Tag, Visit, Place):
+            model.objects.all().delete()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_reverse_relation(self):
+
+        plan = LoadPlan(Book, config.DOCK_DIRECT_RELATION_TYPES)
+        field_name, internal_type, rel, header_args = plan.column(u'notes*text')
+
+        self.assertEqual(internal_type, 'ReverseForeignKey')
+        self.assertIs(rel.related_model, Note)
+        self.assertEqual(rel.field.name, 'book')
+        self.assertEqual(header_args, [u'text'])
+
+        for storage_class in (Store, BulkStore):
+            path = self.write('book.csv', 'name,notes*text\nb,first;second\n')
+            Process([(Book, path)], storage_class=storage_class)
+
+            book = Book.objects.get()
+            self.assertEqual(sorted(book.notes.values_list('text', flat=True)), [u'first', u'second'])
+            Book.objects.all().delete()
+
+    def test_reverse_relation_header(self):
+
+        plan = LoadPlan(Book, config.DOCK_DIRECT_RELATION_TYPES)
+
+        with self.assertRaises(AssertionError):
+            plan.column(u'notes')
+
+        with self.assertRaises(AttributeError):
+            plan.column(u'colour')
+
+        path = self.write('book.csv', 'name,notes*text,colour\nb,first,red\n')
+        process = Process([(Book, path)], dry_run=True)
+
+        self.assertEqual([problem['header'] for problem in process.validation.unknown_headers], [u'colour'])
+
+    def test_bulk_relations(self):
+
+        Tag.objects.create(name=u't')
+        path = self.write('book.csv', 'name,tags,notes*text\n' + ''.join('b%s,t,n\n' % n for n in range(200)))
+
+        with CaptureQueriesContext(connection) as queries:
+            Process([(Book, path)], storage_class=BulkStore, batch_size=100)
+
+        inserts = [query['sql'] for query in queries.captured_queries if 'INSERT INTO' in query['sql']]
+
+        # per batch, one for the books, one for their tags, and one for their notes
+        self.assertEqual(len(inserts), 6)
+        self.assertEqual(Book.tags.through.objects.count(), 200)
+        self.assertEqual(Note.objects.count(), 200)
+        self.assertEqual(set(Note.objects.values_list('book__name', 'text')),
+                         set((u'b%s' % n, u'n') for n in range(200)))
+
+    def test_bulk_pks(self):
+
+        Book.objects.create(name=u'a', pages=1)
+        # an id that does not exist is inserted with that id, next to those that get one
+        path = self.write('book.csv', 'id,name\n,b\n50,c\n,d\n')
+
+        process = Process([(Book, path)], storage_class=BulkStore)
+
+        pks = dict(Book.objects.values_list('name', 'pk'))
+        self.assertEqual(pks[u'c'], 50)
+        for name in (u'b', u'c', u'd'):
+            self.assertEqual(process.identity_map.get(Book, 'name', name).pk, pks[name])
+
+    def test_bulk_identity_map(self):
+
+        places = self.write('place.csv', 'name,count\n' + ''.join('p%s,1\n' % n for n in range(200)))
+        visits = self.write('visit.csv', 'place,id\np7,\np150,\n')
+
+        with CaptureQueriesContext(connection) as queries:
+            process = Process([(Place, places), (Visit, visits)], storage_class=BulkStore)
+
+        self.assertEqual(sorted(Visit.objects.values_list('place__name', flat=True)), [u'p150', u'p7'])
+
+        # the places were created in this run, they are not looked up
+        lookups = [query['sql'] for query in queries.captured_queries if '"tests_place"."name" =' in query['sql']]
+        self.assertEqual(lookups, [])
+        self.assertEqual(process.identity_map.hits, 2)
+
+    def writes(self, queries):
+
+        return [query['sql'] for query in queries.captured_queries
+                if any(statement in query['sql'] for statement in ('INSERT INTO', 'UPDATE ', 'DELETE FROM'))]
+
+    def test_upsert_insert(self):
+
+        for storage_class in (Store, BulkStore):
+            path = self.write('book.csv', 'id,name\n7,a\n9,b\n')
+            Process([(Book, path)], storage_class=storage_class)
+
+            self.assertEqual(list(Book.objects.order_by('pk').values_list('pk', 'name')), [(7, u'a'), (9, u'b')])
+            Book.objects.all().delete()
+
+    def test_upsert_update(self):
+
+        for storage_class in (Store, BulkStore):
+            Book.objects.create(pk=1, name=u'a', pages=10)
+            Book.objects.create(pk=2, name=u'b', pages=20)
+            Book.objects.create(pk=3, name=u'c', pages=30)
+            path = self.write('book.csv', 'id,name,pages\n1,a,10\n2,b,21\n3,z,30\n')
+
+            with CaptureQueriesContext(connection) as queries:
+                Process([(Book, path)], storage_class=storage_class)
+
+            self.assertEqual(list(Book.objects.order_by('pk').values_list('pk', 'name', 'pages')),
+                             [(1, u'a', 10), (2, u'b', 21), (3, u'z', 30)])
+
+            writes = self.writes(queries)
+            # only the objects that changed are written, one query each with Store, in one query with BulkStore
+            self.assertEqual(len(writes), 2 if storage_class is Store else 1)
+            self.assertTrue(all('UPDATE ' in sql for sql in writes))
+            Book.objects.all().delete()
+
+    def test_upsert_unchanged(self):
+
+        tag = Tag.objects.create(name=u't')
+
+        for storage_class in (Store, BulkStore):
+            book = Book.objects.create(pk=1, name=u'a', pages=10)
+            book.tags.add(tag)
+            Note.objects.create(book=book, text=u'n')
+            path = self.write('book.csv', 'id,name,pages,tags,notes*text\n1,a,10,t,n\n')
+
+            with CaptureQueriesContext(connection) as queries:
+                Process([(Book, path)], storage_class=storage_class, stream=True)
+
+            self.assertEqual(self.writes(queries), [])
+            self.assertEqual(Book.tags.through.objects.count(), 1)
+            self.assertEqual(Note.objects.count(), 1)
+            Book.objects.all().delete()
+
+    def test_upsert_relations(self):
+
+        Tag.objects.create(name=u't')
+        Tag.objects.create(name=u'u')
+
+        for storage_class in (Store, BulkStore):
+            book = Book.objects.create(pk=1, name=u'a')
+            book.tags.add(Tag.objects.get(name=u't'))
+            Note.objects.create(book=book, text=u'n')
+
+            # the existing relations are kept, only the new ones are inserted
+            path = self.write('book.csv', 'id,name,tags,notes*text\n1,a,t;u,n;o\n2,b,t,n\n')
+            Process([(Book, path)], storage_class=storage_class)
+
+            self.assertEqual(sorted(Book.tags.through.objects.values_list('book_id', 'tag__name')),
+                             [(1, u't'), (1, u'u'), (2, u't')])
+            self.assertEqual(sorted(Note.objects.values_list('book_id', 'text')), [(1, u'n'), (1, u'o'), (2, u'n')])
+            Book.objects.all().delete()
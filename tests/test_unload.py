@@ -0,0 +1,184 @@
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import unittest
+from dock.core import incoming
+from dock.core.incoming import IncrementalUnload, Manifest, Process, Unload
+from tests.models import Place, Visit
+
+
+class UnloadTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.root = os.path.join(self.directory, 'data')
+
+    def tearDown(self):
+
+        for model in (Visit, Place):
+            model.objects.all().delete()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.root, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def index(self, directory, ordering):
+
+        self.write(os.path.join(directory, 'index.json'), json.dumps({'ordering': ordering}))
+
+    def test_extract_sources(self):
+
+        self.index('', ['tests', 'other'])
+        self.index('tests', ['visit', 'place', 'assets', 'more'])
+        visit = self.write('tests/visit.csv', 'place\n1\n')
+        place = self.write('tests/place.tsv', 'name\ta\n')
+        place_csv = self.write('tests/place.csv', 'name\na\n')
+        self.write('tests/unlisted.csv', 'name\na\n')
+        self.index('tests/assets', ['place'])
+        self.write('tests/assets/place.csv', 'name\na\n')
+        self.index('tests/more', ['place'])
+        more = self.write('tests/more/place.jsonl', '{"name": "a"}\n')
+        # a branch without an index file is not part of the dataset
+        self.write('other/place.csv', 'name\na\n')
+
+        unload = Unload(self.root, supported_extensions=('.tsv', '.csv', '.jsonl'))
+
+        self.assertEqual(unload.extract_sources(), [visit, place, more])
+        self.assertEqual(unload.ignored, [place_csv])
+
+        # without scandir, the directories are listed with os.listdir
+        scandir = incoming.scandir
+        incoming.scandir = None
+
+        try:
+            self.assertEqual(unload.extract_sources(refresh=True), [visit, place, more])
+        finally:
+            incoming.scandir = scandir
+
+    def test_extract_sources_refresh(self):
+
+        self.index('', ['tests'])
+        self.index('tests', ['place', 'visit'])
+        place = self.write('tests/place.csv', 'name\na\n')
+
+        unload = Unload(self.root)
+        self.assertEqual(unload.extract_sources(), [place])
+
+        # the tree is walked once, until asked to walk it again
+        visit = self.write('tests/visit.csv', 'place\n1\n')
+        self.assertEqual(unload.extract_sources(), [place])
+        self.assertEqual(unload.extract_sources(refresh=True), [place, visit])
+
+    def test_map_inventory(self):
+
+        self.index('', ['tests'])
+        self.index('tests', ['place', 'visit'])
+        place = self.write('tests/place.csv', 'name\na\n')
+        visit = self.write('tests/visit.csv', 'place\n1\n')
+
+        unload = Unload(self.root)
+
+        self.assertEqual(unload.map_inventory(), [(Place, place), (Visit, visit)])
+        self.assertEqual(unload.dependency_graph(), ([(Place, place), (Visit, visit)], [set(), {0}]))
+
+    def test_manifest(self):
+
+        place = self.write('tests/place.csv', 'name\na\n')
+        path = os.path.join(self.root, 'manifest')
+
+        manifest = Manifest(path)
+        self.assertFalse(manifest.unchanged(place))
+        manifest.update(place, 1)
+        self.assertTrue(manifest.unchanged(place))
+
+        # touched, but the same content
+        os.utime(place, (0, 0))
+        self.assertTrue(manifest.unchanged(place))
+
+        # the same size, another content
+        self.write('tests/place.csv', 'name\nb\n')
+        os.utime(place, (0, 0))
+        self.assertFalse(manifest.unchanged(place))
+
+        # entries are appended, and a line cut short is ignored
+        manifest.update(place, 1)
+        with open(path, 'a') as f:
+            f.write('["tests/visit.csv",1')
+
+        manifest = Manifest(path)
+        self.assertEqual(sorted(manifest.entries), ['tests/place.csv'])
+        self.assertTrue(manifest.unchanged(place))
+
+        manifest.compact()
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_manifest_unload(self):
+
+        self.index('', ['tests'])
+        self.index('tests', ['place', 'visit'])
+        place = self.write('tests/place.csv', 'name,count\na,1\n')
+        visit = self.write('tests/visit.csv', 'place,id\na,\n')
+
+        unload = Unload(self.root, manifest_file='manifest')
+        Process(unload.map_inventory(), manifest=unload.manifest)
+        self.assertEqual(Visit.objects.get().place.name, u'a')
+
+        # nothing changed, there is nothing to load
+        unload = Unload(self.root, manifest_file='manifest')
+        self.assertEqual(unload.map_inventory(), [])
+        self.assertEqual(unload.skipped, [place, visit])
+
+        self.write('tests/visit.csv', 'place,id\na,\na,\n')
+        unload = Unload(self.root, manifest_file='manifest')
+        self.assertEqual(unload.map_inventory(), [(Visit, visit)])
+
+    def git(self, *args):
+
+        subprocess.check_call(('git', '-c', 'user.name=dock', '-c', 'user.email=dock@example.com') + args,
+                              cwd=self.directory, stdout=open(os.devnull, 'w'))
+
+    def test_incremental(self):
+
+        self.git('init', '-q')
+        self.index('', ['tests'])
+        self.index('tests', ['place', 'visit'])
+        place = self.write('tests/place.csv', 'name,count\na,1\nb,2\n')
+        visit = self.write('tests/visit.csv', 'place,id\na,\n')
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'first')
+
+        # nothing was loaded yet, everything is
+        unload = IncrementalUnload(self.root)
+        self.assertEqual(unload.map_inventory(), [(Place, place), (Visit, visit)])
+        unload.commit()
+        self.assertTrue(os.path.exists(os.path.join(self.directory, '.git', 'dock_last_load')))
+
+        self.write('tests/place.csv', 'name,count\na,1\nb,3\nc,4\n')
+        self.git('commit', '-q', '-a', '-m', 'second')
+
+        unload = IncrementalUnload(self.root)
+        inventory = unload.map_inventory()
+
+        # only the rows that were added or changed, and the row they replaced is counted
+        self.assertEqual([model for model, data_source in inventory], [Place])
+        self.assertEqual(inventory[0][1].read(), 'name,count\r\nb,3\r\nc,4\r\n')
+        self.assertEqual(unload.removed, {place: 1})
+
+        inventory[0][1].seek(0)
+        Process(inventory)
+        unload.commit()
+        self.assertEqual(sorted(Place.objects.values_list('name', 'count')), [(u'b', 3), (u'c', 4)])
+
+        # until the next commit, there is nothing new
+        unload = IncrementalUnload(self.root)
+        self.assertEqual(unload.map_inventory(), [])